@@ -1,8 +1,8 @@
 
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from config import config
 from flask_cors import CORS
+from .database import SQLAlchemy
 
 from flask_jwt_extended import create_access_token
 from flask_jwt_extended import get_jwt_identity
@@ -17,10 +17,37 @@ def create_app(config_name):
     CORS(app)
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
+
+    from .json_provider import JSONProvider
+    app.json = JSONProvider(app)
+
     db.init_app(app)
+    from . import database
+    database.init_app(app)
+    from . import query_stats
+    query_stats.init_app(app)
+    from . import metrics
+    metrics.init_app(app)
+    from . import profiling
+    profiling.init_app(app)
     # jwt = JWTManager(app)
     jwt.init_app(app)
 
+    from . import role_registry
+    role_registry.init_app(app)
+
+    from . import follow_graph
+    follow_graph.init_app(app)
+
+    from . import search
+    search.init_app(app)
+
+    from . import autocomplete
+    autocomplete.init_app(app)
+
+    # (the builds above used pooled connections)
+    database.dispose(app)
+
     from .postRoute import postRoute as postRouteBlueprint
     app.register_blueprint(postRouteBlueprint) 
 
@@ -36,4 +63,7 @@ def create_app(config_name):
     from .likesRoute import likesRoute as likesRouteBlueprint
     app.register_blueprint(likesRouteBlueprint)
 
+    from .adminRoute import adminRoute as adminRouteBlueprint
+    app.register_blueprint(adminRouteBlueprint)
+
     return app
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+adminRoute = Blueprint('adminRoute', __name__)
+
+from . import views
\ No newline at end of file
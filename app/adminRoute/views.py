@@ -0,0 +1,56 @@
+import os
+from flask import current_app, jsonify, send_from_directory
+from flask_jwt_extended import jwt_required
+from ..decorators import admin_required
+from .. import follow_graph
+from .. import metrics
+from .. import profiling
+from . import adminRoute
+from app.postRoute.errors import custom404
+
+
+# request metrics of all the workers, in prometheus text format (app/metrics.py)
+@adminRoute.route('/metrics')
+@jwt_required()
+@admin_required
+def prometheus_metrics():
+    if not current_app.config['METRICS_ENABLED']:
+        return custom404("Metrics are not enabled.")
+    return current_app.response_class(metrics.render(current_app.config['METRICS_DIR']),
+                                      content_type=metrics.CONTENT_TYPE)
+
+
+# in-memory follow graph of the worker answering this compared with the follows table
+# (app/follow_graph.py), the first 100 differences of each kind
+@adminRoute.route('/follow-graph/check')
+@jwt_required()
+@admin_required
+def check_follow_graph():
+    missing, extra = follow_graph.check()
+    return jsonify({
+        "pid": os.getpid(),
+        "missing_count": len(missing),
+        "extra_count": len(extra),
+        "missing": [list(each_edge) for each_edge in missing[:100]],
+        "extra": [list(each_edge) for each_edge in extra[:100]]
+    })
+
+
+# profiles of requests, newest first (app/profiling.py)
+@adminRoute.route('/profiles')
+@jwt_required()
+@admin_required
+def get_profiles():
+    if not current_app.config['PROFILING_ENABLED']:
+        return custom404("Profiling is not enabled.")
+    return jsonify({"profiles": profiling.list_profiles(current_app.config['PROFILING_DIR'])})
+
+
+# download of a profile (pstats file)
+@adminRoute.route('/profiles/<name>')
+@jwt_required()
+@admin_required
+def download_profile(name):
+    if not current_app.config['PROFILING_ENABLED'] or not name.endswith(profiling.SUFFIX):
+        return custom404("Profile not found.")
+    return send_from_directory(current_app.config['PROFILING_DIR'], name, as_attachment=True)
@@ -1,14 +1,14 @@
 
-from datetime import timedelta
 from app.postRoute.errors import bad_request, custom404, unauthorized
 from . import authRoute
 from flask import request, jsonify, current_app
-from ..models import User, TokenBlocklist
-from datetime import datetime
-from datetime import timezone
+from ..models import User
 
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, current_user
 from flask_jwt_extended import decode_token, get_jwt
+from .. import autocomplete
+from .. import blocklist
+from .. import search
 from .. import db
 
 
@@ -26,16 +26,22 @@ def login():
         return bad_request("Incorrect Password.")
 
     else:
+        # upgrading the stored hash to the current hash settings (only possible here, where the
+        # plain password is known)
+        if user.password_needs_rehash():
+            user.password = password
+            db.session.add(user)
+            db.session.commit()
+
         # jwt
         # config options => https://flask-jwt-extended.readthedocs.io/en/stable/options/#jwt-access-token-expires
-        # more time options => https://docs.python.org/3/library/datetime.html#timedelta-objects
+        # (expires after JWT_ACCESS_TOKEN_EXPIRES, set in config.py)
 
         wrap_data = {"user_id": user.id}
 
         access_token = create_access_token(
             identity=email,
-            additional_claims=wrap_data,
-            expires_delta=timedelta(minutes=40)
+            additional_claims=wrap_data
         )
         # print(decode_token(access_token))
         return jsonify(access_token=access_token, user_id=user.id)
@@ -47,8 +53,7 @@ def logout():
     # token_from_client = request.json.get('access_token', None)
     # token_from_client
     jti = get_jwt()['jti']
-    now = datetime.now(timezone.utc)
-    db.session.add(TokenBlocklist(jti=jti, created_at=now))
+    blocklist.revoke(jti)
     db.session.commit()
 
     return jsonify({ "msg" : "Logged out."})
@@ -69,6 +74,8 @@ def register():
     else:
         user = User(email=email.lower(), username=username, password=password)
         db.session.add(user)
+        search.user_added(user)
+        autocomplete.user_added(user)
         db.session.commit()
 
         return jsonify({"msg": "Registration Successful, Thanks."})
@@ -0,0 +1,176 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+from . import db
+from . import follow_graph
+from . import loaders
+
+# username autocomplete ("usernames starting with ...")
+# every worker keeps the lowercase usernames in a sorted list of (username, user id), so all the
+# usernames starting with a prefix are next to each other and found with a binary search, no
+# LIKE scan on the users table. users the caller follows come first (their names are checked
+# directly, from the follow graph), the rest is filled up alphabetically.
+#
+# built at create_app, and kept up to date:
+# - register, update_username and delete_user change the list of this worker once committed
+# - users registered through other workers are read every AUTOCOMPLETE_REFRESH_SECONDS (the
+#   users with an id above the highest one seen)
+# - renames and deletions in other workers only show up with the next full build, every
+#   AUTOCOMPLETE_REBUILD_SECONDS. until then results are checked against the real usernames
+#   (loaded anyway for the response), so a stale entry is skipped, never returned.
+
+
+class UsernameIndex:
+
+    def __init__(self):
+        self.entries = []  # sorted (lowercase username, user id)
+        self.names = {}  # user id => lowercase username
+        self.last_id = 0
+        self.next_refresh = None  # (None until the index got built)
+        self.next_build = 0
+        self.lock = threading.RLock()
+
+    def build(self):
+        from .models import User
+
+        with self.lock:
+            rows = db.session.query(User.id, User.username).all()
+            names = {each_id: each_username.lower() for each_id, each_username in rows if each_username}
+
+            self.names = names
+            self.entries = sorted((each_name, each_id) for each_id, each_name in names.items())
+            self.last_id = max(names, default=0)
+            now = time.monotonic()
+            self.next_refresh = now + current_app.config['AUTOCOMPLETE_REFRESH_SECONDS']
+            self.next_build = now + current_app.config['AUTOCOMPLETE_REBUILD_SECONDS']
+
+    def refresh(self):
+        from .models import User
+
+        with self.lock:
+            new_users = db.session.query(User.id, User.username).filter(User.id > self.last_id).all()
+            for each_id, each_username in new_users:
+                self.add(each_id, each_username)
+            self.next_refresh = time.monotonic() + current_app.config['AUTOCOMPLETE_REFRESH_SECONDS']
+
+    def add(self, user_id, username):
+        if not username:
+            return
+        with self.lock:
+            self.remove(user_id)
+            self.names[user_id] = username.lower()
+            insort(self.entries, (username.lower(), user_id))
+            self.last_id = max(self.last_id, user_id)
+
+    def remove(self, user_id):
+        with self.lock:
+            name = self.names.pop(user_id, None)
+            if name is None:
+                return
+            position = bisect_left(self.entries, (name, user_id))
+            if position < len(self.entries) and self.entries[position] == (name, user_id):
+                del self.entries[position]
+
+    def _fresh(self):
+        now = time.monotonic()
+        if self.next_refresh is None or now >= self.next_build:
+            self.build()
+        elif now >= self.next_refresh:
+            self.refresh()
+        return self
+
+    # ids of users starting with prefix, in username order, at most `limit` of them
+    def starting_with(self, prefix, limit):
+        self._fresh()
+        matches = []
+        position = bisect_left(self.entries, (prefix,))
+        while position < len(self.entries) and len(matches) < limit:
+            name, user_id = self.entries[position]
+            if not name.startswith(prefix):
+                break
+            matches.append(user_id)
+            position += 1
+        return matches
+
+
+index = UsernameIndex()
+
+
+# up to `limit` users whose username starts with typed, followed users first
+# returns [(User, followed by user), ...]
+def complete(user, typed, limit):
+    prefix = (typed or '').strip().lower()
+    if not prefix:
+        return []
+
+    index._fresh()
+    followed = [each_id for each_id in follow_graph.following_of(user.id)
+                if index.names.get(each_id, '').startswith(prefix)]
+    followed.sort(key=lambda each_id: index.names[each_id])
+    followed_ids = set(followed)
+
+    # (a few extra, stale entries are skipped below)
+    others = [each_id for each_id in index.starting_with(prefix, limit + len(followed_ids) + 10)
+              if each_id != user.id and each_id not in followed_ids]
+
+    candidates = followed[:limit] + others
+    found_users = {each_user.id: each_user for each_user in loaders.prime_users(candidates)}
+    completions = []
+    for each_id in candidates:
+        each_user = found_users.get(each_id)
+        if each_user is None or not each_user.username.lower().startswith(prefix):
+            continue
+        completions.append((each_user, each_id in followed_ids))
+    return completions[:limit]
+
+
+# write paths, applied to this worker once committed
+
+def _queue(change):
+    db.session.info.setdefault('autocomplete_changes', []).append(change)
+
+
+def user_added(user):
+    # user id is only there after a flush
+    db.session.flush()
+    _queue((user.id, user.username))
+
+
+def user_renamed(user):
+    _queue((user.id, user.username))
+
+
+def user_removed(user):
+    _queue((user.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop('autocomplete_changes', [])
+    if index.next_refresh is None:
+        return
+    for user_id, username in changes:
+        if username is None:
+            index.remove(user_id)
+        else:
+            index.add(user_id, username)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('autocomplete_changes', None)
+
+
+# called by create_app (like app/follow_graph.py, without tables the index is built on first use)
+def init_app(app):
+    with app.app_context():
+        try:
+            index.build()
+        except (OperationalError, ProgrammingError):
+            index.next_refresh = None
+        finally:
+            db.session.remove()
@@ -0,0 +1,95 @@
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import delete, func, select
+from . import db
+
+# revoked tokens (logout, deleted users) kept in memory
+# check_if_token_revoked runs on every authenticated request, so instead of looking every token up
+# in the token_blocklist table, every worker process keeps the jti of the recently revoked tokens
+# in a dict and checks that. new rows of the table (revoked by any worker) are picked up at most
+# BLOCKLIST_REFRESH_SECONDS later, with a query for the rows after the last id seen (a range scan
+# on the primary key, usually returning nothing).
+#
+# a token can only be used until it expires (JWT_ACCESS_TOKEN_EXPIRES), so a jti revoked longer
+# ago than that is not needed anymore, it gets dropped from memory and `flask purge-blocklist`
+# deletes such rows from the table (run it from cron, example: every hour).
+
+
+class RevokedTokens:
+
+    def __init__(self):
+        self.jtis = {}  # jti => time it was revoked at
+        self.last_id = 0
+        self.next_refresh = 0
+        self.lock = threading.Lock()
+
+    def contains(self, jti):
+        if time.monotonic() >= self.next_refresh:
+            self.refresh()
+        return jti in self.jtis
+
+    def add(self, jti, revoked_at):
+        with self.lock:
+            self.jtis[jti] = revoked_at
+
+    def refresh(self):
+        from .models import TokenBlocklist
+
+        with self.lock:
+            # (another thread refreshed while this one was waiting for the lock)
+            if time.monotonic() < self.next_refresh:
+                return
+
+            cutoff = _oldest_usable()
+            new_rows = db.session.query(TokenBlocklist.id, TokenBlocklist.jti, TokenBlocklist.created_at) \
+                .filter(TokenBlocklist.id > self.last_id, TokenBlocklist.created_at >= cutoff) \
+                .order_by(TokenBlocklist.id).all()
+
+            for each_id, each_jti, each_created_at in new_rows:
+                self.jtis[each_jti] = each_created_at
+                self.last_id = each_id
+
+            # forgetting tokens which are expired anyway
+            for each_jti in [jti for jti, revoked_at in self.jtis.items() if revoked_at < cutoff]:
+                del self.jtis[each_jti]
+
+            self.next_refresh = time.monotonic() + current_app.config['BLOCKLIST_REFRESH_SECONDS']
+
+
+revoked_tokens = RevokedTokens()
+
+
+# tokens revoked before this time are expired by now (stored times are utc without a timezone)
+def _oldest_usable():
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now - current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+
+
+def is_revoked(jti):
+    return revoked_tokens.contains(jti)
+
+
+# blocking a token, the row is committed by the caller
+def revoke(jti):
+    from .models import TokenBlocklist
+
+    now = datetime.now(timezone.utc)
+    db.session.add(TokenBlocklist(jti=jti, created_at=now))
+    # this worker knows about it right away, the others on their next refresh
+    revoked_tokens.add(jti, now.replace(tzinfo=None))
+
+
+# deleting the rows of tokens which are expired by now, returns how many got deleted
+def purge():
+    from .models import TokenBlocklist
+
+    # the newest row always stays, so ids never start over again (refresh relies on them growing)
+    newest_id = select(func.max(TokenBlocklist.id)).scalar_subquery()
+    deleted = db.session.execute(delete(TokenBlocklist).where(
+        TokenBlocklist.created_at < _oldest_usable(),
+        TokenBlocklist.id < newest_id
+    ).execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return deleted
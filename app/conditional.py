@@ -0,0 +1,35 @@
+from datetime import timezone
+from flask import make_response, request
+
+# conditional GETs (If-None-Match / If-Modified-Since)
+# views which can tell the ETag and Last-Modified of their response up front (app/versions.py)
+# answer an unchanged refresh with an empty 304, without building the json at all.
+# responses are only for the logged in user (private) and always revalidated (no-cache).
+
+
+def _second(time):
+    # (http dates have no microseconds, stored times are utc without a timezone)
+    return time.replace(microsecond=0, tzinfo=timezone.utc)
+
+
+# client already has this version
+def is_fresh(etag, last_modified):
+    # If-None-Match wins when both are sent
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return _second(last_modified) <= request.if_modified_since
+    return False
+
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _second(last_modified)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified):
+    return with_validators(make_response('', 304), etag, last_modified)
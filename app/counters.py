@@ -0,0 +1,69 @@
+from sqlalchemy import func, select, update
+from . import db
+from . import versions
+
+# denormalized engagement counters
+# Post.like_count, Post.comment_count, User.follower_count, User.following_count and User.post_count
+# are kept next to the rows they count, so clients can get "N likes" without loading the likes.
+# they are changed in the same transaction as the like/comment/follow/post itself, always as
+# "column = column + 1" in sql (not read, add and write back in python), so two requests
+# changing the same counter at once can not lose an update.
+# a changed counter means a changed post/profile, so the version of the row is bumped as well
+# (app/versions.py).
+
+
+def add(obj, counter, amount=1):
+    # (__class__ and not type(), current_user is a proxy of the user)
+    setattr(obj, counter, getattr(obj.__class__, counter) + amount)
+    versions.touch(obj)
+
+
+# same as add, for many rows (by id) with a single update statement
+def add_many(model, ids, counter, amount=1):
+    column = getattr(model, counter)
+    db.session.execute(
+        update(model).where(model.id.in_(ids))
+        .values(dict(versions.bumped(model), **{counter: column + amount}))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# user is getting deleted, their follows are removed with them (delete-orphan), so the users they
+# followed lose a follower and the users following them lose a followed user
+def remove_user(user):
+    from .models import Follow, User
+
+    followed_ids = select(Follow.following_to).where(Follow.follower_id == user.id)
+    follower_ids = select(Follow.follower_id).where(Follow.following_to == user.id)
+
+    db.session.execute(
+        update(User).where(User.id.in_(followed_ids))
+        .values(follower_count=User.follower_count - 1, **versions.bumped(User))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(User).where(User.id.in_(follower_ids))
+        .values(following_count=User.following_count - 1, **versions.bumped(User))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# recounting every counter from the base tables (likes, comments, follows and posts)
+def rebuild_all():
+    from .models import Comment, Follow, Post, PostLike, User
+
+    def count_of(column, matching):
+        return select(func.count()).where(column == matching).scalar_subquery()
+
+    db.session.execute(update(Post).values(
+        like_count=count_of(PostLike.post_id, Post.id),
+        comment_count=count_of(Comment.post_id, Post.id)
+    ).execution_options(synchronize_session=False))
+
+    db.session.execute(update(User).values(
+        follower_count=count_of(Follow.following_to, User.id),
+        following_count=count_of(Follow.follower_id, User.id),
+        post_count=count_of(Post.author_id, User.id)
+    ).execution_options(synchronize_session=False))
+
+    db.session.commit()
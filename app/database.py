@@ -0,0 +1,84 @@
+from flask import g, has_request_context
+from flask_sqlalchemy import SignallingSession
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.pool import QueuePool
+
+# sqlite connection settings and read-only connections
+# - SQLITE_PRAGMAS are set on every new connection (connect event), the production profile uses
+#   WAL (readers and the writer do not block each other anymore), synchronous=NORMAL (no fsync
+#   on every commit, still safe with WAL), a busy_timeout (a second writer waits for the lock
+#   instead of failing right away) and bigger mmap / page caches
+# - with SQLITE_READ_POOL_SIZE, endpoints marked @read_only (app/decorators.py) run their queries
+#   on a separate pool of connections to the same file, opened with query_only. with WAL they
+#   read the last committed data while a write is going on, never waiting for the writer.
+#   anything flushed in such a request still goes to the normal connection.
+#
+# nothing of this applies to in-memory databases (a second connection would be another database).
+
+# settings of the database file itself / of the writer only, not set on read-only connections
+WRITER_PRAGMAS = ('journal_mode', 'synchronous')
+
+
+def _set_pragmas(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for each_name, each_value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (each_name, each_value))
+        cursor.close()
+    return set_pragmas
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        read_engine = self.app.extensions.get('read_only_engine')
+        if read_engine is not None and not self._flushing and has_request_context() and g.get('read_only'):
+            return read_engine
+        return super().get_bind(mapper, clause)
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def _is_file(url):
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+# called by create_app, before anything connects
+def init_app(app):
+    from . import db
+
+    engine = db.get_engine(app)
+    if not _is_file(engine.url):
+        return
+
+    pragmas = app.config['SQLITE_PRAGMAS']
+    if pragmas:
+        event.listen(engine, 'connect', _set_pragmas(pragmas))
+
+    pool_size = app.config['SQLITE_READ_POOL_SIZE']
+    if pool_size:
+        read_pragmas = {each_name: each_value for each_name, each_value in pragmas.items()
+                        if each_name not in WRITER_PRAGMAS}
+        read_pragmas['query_only'] = 'on'
+
+        read_engine = create_engine(
+            engine.url, poolclass=QueuePool, pool_size=pool_size,
+            connect_args={'check_same_thread': False})
+        event.listen(read_engine, 'connect', _set_pragmas(read_pragmas))
+        app.extensions['read_only_engine'] = read_engine
+
+
+# closing the pooled connections, a forking server (gunicorn --preload) must not hand the
+# connections of the parent process to its workers
+def dispose(app):
+    from . import db
+
+    db.get_engine(app).dispose()
+    read_engine = app.extensions.get('read_only_engine')
+    if read_engine is not None:
+        read_engine.dispose()
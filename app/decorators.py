@@ -3,6 +3,7 @@ from app.postRoute.errors import forbidden
 # from .models import Permission, User
 from flask_jwt_extended import current_user
 from .models import Permission
+from flask import g
 from functools import wraps
 
 # Note:
@@ -42,3 +43,13 @@ def permission_required(permission):
 
 def admin_required(f):
     return permission_required(Permission.ADMIN)(f)
+
+
+# queries of the request go to the read-only connections, when there are any (app/database.py)
+# (goes right below the route, so the user lookup of jwt_required reads from them too)
+def read_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
@@ -0,0 +1,145 @@
+from sqlalchemy import cast, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from . import db
+from . import pagination
+
+# inbox summaries
+# every user has one Conversation row per user they chatted with, holding the last message, its
+# time and how many messages of that conversation they did not read yet. the rows are kept up to
+# date on the message write path (send, read, delete), so the inbox is a range scan on
+# ix_conversations_owner_id_timestamp instead of grouping every message of the user.
+#
+# like app/timeline.py these functions only add statements to the session, the caller commits.
+NO_SYNC = {'synchronize_session': False}
+
+
+def _upsert(owner_id, other_user_id, message, unread):
+    from .models import Conversation
+
+    statement = insert(Conversation).values(
+        owner_id=owner_id,
+        other_user_id=other_user_id,
+        last_message_id=message.id,
+        timestamp=message.timestamp,
+        unread_count=unread
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['owner_id', 'other_user_id'],
+        set_={
+            'last_message_id': statement.excluded.last_message_id,
+            'timestamp': statement.excluded.timestamp,
+            'unread_count': Conversation.unread_count + statement.excluded.unread_count
+        }
+    ))
+
+
+def message_sent(message):
+    # message id and timestamp are only there after a flush
+    db.session.flush()
+    _upsert(message.sent_by, message.sent_for, message, 0)
+    _upsert(message.sent_for, message.sent_by, message, 1)
+
+
+# owner opened the conversation with other_user, every message they received in it is read now
+# returns False when there was nothing unread (so the caller has nothing to commit)
+def conversation_read(owner_id, other_user_id):
+    from .models import Conversation, Message
+
+    summary = Conversation.query.filter_by(owner_id=owner_id, other_user_id=other_user_id).first()
+    if summary is None or summary.unread_count == 0:
+        return False
+
+    db.session.execute(update(Message).where(
+        Message.sent_by == other_user_id,
+        Message.sent_for == owner_id,
+        Message.read.is_(False)
+    ).values(read=True).execution_options(**NO_SYNC))
+
+    db.session.execute(update(Conversation).where(
+        Conversation.owner_id == owner_id,
+        Conversation.other_user_id == other_user_id
+    ).values(unread_count=0).execution_options(**NO_SYNC))
+    return True
+
+
+# message is getting deleted, both summaries of its conversation move back to the message
+# before it (or go away, if it was the only one)
+def message_deleted(message):
+    from .models import Conversation, Message
+
+    previous_messages, _ = Message.conversation(message.sent_by, message.sent_for, None, 2)
+    previous_messages = [each_msg for each_msg in previous_messages if each_msg.id != message.id]
+
+    both_sides = [(message.sent_by, message.sent_for), (message.sent_for, message.sent_by)]
+    for owner_id, other_user_id in both_sides:
+        summary = Conversation.query.filter_by(owner_id=owner_id, other_user_id=other_user_id).first()
+        if summary is None:
+            continue
+
+        if not previous_messages:
+            db.session.delete(summary)
+            continue
+
+        if summary.last_message_id == message.id:
+            summary.last_message_id = previous_messages[0].id
+            summary.timestamp = previous_messages[0].timestamp
+        if owner_id == message.sent_for and not message.read:
+            summary.unread_count = Conversation.unread_count - 1
+        db.session.add(summary)
+
+
+def remove_user(user):
+    from .models import Conversation
+    db.session.execute(delete(Conversation).where(
+        (Conversation.owner_id == user.id) | (Conversation.other_user_id == user.id)
+    ).execution_options(**NO_SYNC))
+
+
+# a page of the inbox of user (latest activity first), returns (conversations, next_cursor)
+def read_page(user, cursor, limit):
+    from .models import Conversation
+    user_conversations = Conversation.query.filter_by(owner_id=user.id)
+    return pagination.paginate(user_conversations, Conversation, cursor, limit)
+
+
+# (re)building every summary from the messages table
+def rebuild_all():
+    from .models import Conversation, Message
+
+    db.session.execute(delete(Conversation).execution_options(**NO_SYNC))
+
+    # every message seen from both sides (owner, other user)
+    sides = select(
+        Message.id.label('message_id'),
+        Message.timestamp.label('timestamp'),
+        Message.sent_by.label('owner_id'),
+        Message.sent_for.label('other_user_id'),
+        cast(0, db.Integer).label('unread')
+    ).union_all(select(
+        Message.id,
+        Message.timestamp,
+        Message.sent_for,
+        Message.sent_by,
+        cast(Message.read.is_(False), db.Integer)
+    )).subquery()
+
+    rank = func.row_number().over(
+        partition_by=(sides.c.owner_id, sides.c.other_user_id),
+        order_by=(sides.c.timestamp.desc(), sides.c.message_id.desc())
+    ).label('rank')
+    unread = func.sum(sides.c.unread).over(
+        partition_by=(sides.c.owner_id, sides.c.other_user_id)
+    ).label('unread_count')
+    ranked = select(sides, rank, unread).subquery()
+
+    latest = select(
+        ranked.c.owner_id,
+        ranked.c.other_user_id,
+        ranked.c.message_id,
+        ranked.c.timestamp,
+        ranked.c.unread_count
+    ).where(ranked.c.rank == 1, ranked.c.owner_id.isnot(None), ranked.c.other_user_id.isnot(None))
+
+    db.session.execute(insert(Conversation).from_select(
+        ['owner_id', 'other_user_id', 'last_message_id', 'timestamp', 'unread_count'], latest))
+    db.session.commit()
@@ -0,0 +1,75 @@
+import time
+from datetime import date, datetime, timezone
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # (optional, the standard json module is used without it)
+    orjson = None
+
+# json of every response (jsonify, app/streaming.py ...)
+# encodes with orjson when it is installed (and JSON_FAST_ENCODER is on), it is several times
+# faster than the json module, especially for the datetimes every post, comment and message has.
+# without orjson the json module is used, giving the same output.
+#
+# datetimes are written as ISO-8601, stored times are utc without a timezone so they get "+00:00"
+# (example "2022-10-05T14:48:00.123456+00:00"), instead of flask's default http date format.
+
+
+def _iso(value):
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+def _default(value):
+    if isinstance(value, date):
+        return _iso(value)
+    # (decimals, uuids, dataclasses ... like flask does)
+    return DefaultJSONProvider.default(value)
+
+
+class JSONProvider(DefaultJSONProvider):
+
+    default = staticmethod(_default)
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.fast = orjson is not None and app.config.get('JSON_FAST_ENCODER', True)
+
+    def dumps(self, obj, **kwargs):
+        if not self.fast:
+            return super().dumps(obj, **kwargs)
+
+        # (orjson output is always compact, indent is the only formatting it knows)
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if self.fast and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+
+# micro-benchmark, seconds per encoding of payloads with every encoder ("flask default" is the
+# encoder used before this provider), see `flask benchmark-json`
+def benchmark(app, payloads, rounds=200):
+    encoders = {'flask default': DefaultJSONProvider(app)}
+    fallback = JSONProvider(app)
+    fallback.fast = False
+    encoders['json module'] = fallback
+    if orjson is not None:
+        encoders['orjson'] = JSONProvider(app)
+        encoders['orjson'].fast = True
+
+    results = {}
+    for each_name, each_encoder in encoders.items():
+        started = time.perf_counter()
+        for _ in range(rounds):
+            each_encoder.dumps(payloads)
+        results[each_name] = (time.perf_counter() - started) / rounds
+    return results
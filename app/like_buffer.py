@@ -0,0 +1,391 @@
+import atexit
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from flask import current_app, g, has_request_context
+from flask_jwt_extended import get_current_user, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from sqlalchemy import Integer, bindparam, create_engine, delete, event, exists, func, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.pool import QueuePool
+from . import db
+from . import versions
+
+logger = logging.getLogger(__name__)
+
+# write-behind likes (LIKE_BUFFER_ENABLED, off by default)
+# likes come in spikes on popular posts, and every like was its own transaction waiting for the
+# single sqlite writer. with the buffer on, PUT / DELETE /posts/<id>/like (app/likes.py) only
+# record the event in memory, with the time it was made, per (user, post) the last one wins
+# (like + unlike + like is one like). every LIKE_BUFFER_FLUSH_MS, or as soon as
+# LIKE_BUFFER_MAX_EVENTS are waiting, a background thread of the worker writes all of them in one
+# transaction: the events go to like_actions (LikeAction) unless it already has a newer one for
+# the same user and post, then one executemany insert and one executemany delete bring postlikes
+# to the state of like_actions (both against uq_postlikes_user_id_post_id, so events which change
+# nothing are no-ops) and like_count of the touched posts is counted again.
+#
+# - every worker has its own buffer. a like waiting in one worker and an unlike waiting in
+#   another one end up as the newer of the two, whichever worker flushes first.
+# - read your writes: the user who liked sees their own waiting events right away, in the like
+#   responses and in the posts of requests they are logged in for (Post.to_json, and the ETags
+#   of app/versions.py), as long as those requests reach the same worker. on the other workers,
+#   and for everybody else, they show up after the flush (LIKE_BUFFER_FLUSH_MS).
+# - the waiting events are written when the worker exits (atexit, or call flush() from the
+#   worker_exit hook of gunicorn). a worker which gets killed loses up to one interval of likes.
+# - a failed flush puts its events back and is tried again with the next one.
+
+
+def enabled():
+    return current_app.config['LIKE_BUFFER_ENABLED']
+
+
+class LikeBuffer:
+
+    def __init__(self):
+        self.events = {}  # (user id, post id) => (liked, time.time())
+        self.flushing = {}  # events being written right now (still "waiting" for readers)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.engine = None
+        self.pid = None
+
+    # starts the flushing thread of this process (again after a fork)
+    def start(self, engine, flush_ms, max_events, keep_actions_seconds=3600):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.engine = engine
+            self.interval = flush_ms / 1000
+            self.max_events = max_events
+            self.keep_actions_seconds = keep_actions_seconds
+            self.events, self.flushing = {}, {}
+            self.pid = os.getpid()
+        threading.Thread(target=self._run, args=(self.pid,), daemon=True).start()
+
+    def stop(self):
+        self.pid = None
+        self.wake.set()
+
+    def _run(self, pid):
+        while self.pid == pid:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # (the events were put back, they go with the next flush)
+                logger.exception('flushing %d likes failed', len(self.events))
+
+    def add(self, user_id, post_id, liked):
+        with self.lock:
+            self.events[(user_id, post_id)] = (liked, time.time())
+            full = len(self.events) >= self.max_events
+        if full:
+            self.wake.set()
+
+    def is_empty(self):
+        return not self.events and not self.flushing
+
+    # waiting state of a like, None when there is no waiting event
+    def waiting(self, user_id, post_id):
+        key = (user_id, post_id)
+        with self.lock:
+            event = self.events.get(key) or self.flushing.get(key)
+        return None if event is None else event[0]
+
+    # writes the waiting events, returns how many
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.events:
+                    return 0
+                self.flushing, self.events = self.events, {}
+
+            try:
+                with self.engine.begin() as connection:
+                    write(connection, self.flushing, self.keep_actions_seconds)
+                written = len(self.flushing)
+            except Exception:
+                with self.lock:
+                    # (newer events of the same user and post win)
+                    self.events = {**self.flushing, **self.events}
+                raise
+            finally:
+                with self.lock:
+                    self.flushing = {}
+            return written
+
+
+buffer = LikeBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    if buffer.pid == os.getpid():
+        buffer.flush()
+
+
+def flush():
+    return buffer.flush()
+
+
+# newest_is: None, or a function giving the condition "the newest event of the user on the post
+# is a like (True) / an unlike (False)"
+def _statements(newest_is=None):
+    from .models import Post, PostLike, User
+
+    likes_table = PostLike.__table__
+    # (nothing gets inserted for a post or user which does not exist (anymore))
+    add_conditions = [
+        Post.__table__.c.id == bindparam('liked_post_id'),
+        exists().where(User.__table__.c.id == bindparam('liker_id'))
+    ]
+    remove_conditions = [
+        likes_table.c.user_id == bindparam('liker_id'),
+        likes_table.c.post_id == bindparam('liked_post_id')
+    ]
+    if newest_is is not None:
+        add_conditions.append(newest_is(True))
+        remove_conditions.append(newest_is(False))
+
+    add_likes = sqlite_insert(likes_table).from_select(
+        ['user_id', 'post_id'],
+        select(bindparam('liker_id', type_=Integer), Post.__table__.c.id).where(*add_conditions)
+    ).on_conflict_do_nothing(index_elements=['user_id', 'post_id'])
+    remove_likes = delete(likes_table).where(*remove_conditions)
+    return add_likes, remove_likes
+
+
+# events into like_actions, unless it has a newer one for the user and post (another worker)
+def _record_actions():
+    from .models import LikeAction
+
+    actions_table = LikeAction.__table__
+    statement = sqlite_insert(actions_table).values(
+        user_id=bindparam('liker_id'),
+        post_id=bindparam('liked_post_id'),
+        liked=bindparam('action_liked'),
+        at=bindparam('action_at')
+    )
+    return statement.on_conflict_do_update(
+        index_elements=['user_id', 'post_id'],
+        set_={'liked': statement.excluded.liked, 'at': statement.excluded.at},
+        where=statement.excluded.at > actions_table.c.at
+    )
+
+
+def _newest_is(liked):
+    from .models import LikeAction
+
+    actions_table = LikeAction.__table__
+    return exists().where(
+        actions_table.c.user_id == bindparam('liker_id'),
+        actions_table.c.post_id == bindparam('liked_post_id'),
+        actions_table.c.liked == liked
+    )
+
+
+# events: {(user id, post id): (liked, time)}, written with connection (the caller commits)
+def write(connection, events, keep_actions_seconds=3600):
+    from .models import LikeAction, Post, PostLike
+
+    rows = [{'liker_id': each_user_id, 'liked_post_id': each_post_id,
+             'action_liked': each_liked, 'action_at': each_at}
+            for (each_user_id, each_post_id), (each_liked, each_at) in events.items()]
+
+    # (executemany) the newest events into like_actions, then postlikes as like_actions says
+    add_likes, remove_likes = _statements(_newest_is)
+    connection.execute(_record_actions(), rows)
+    connection.execute(add_likes, rows)
+    connection.execute(remove_likes, rows)
+
+    # (no event that old can still be waiting in a worker)
+    connection.execute(delete(LikeAction.__table__).where(
+        LikeAction.__table__.c.at < time.time() - keep_actions_seconds))
+
+    # counted again instead of +1 / -1 for every row that changed, the transaction holds the
+    # write lock by now, so the count is right whatever other workers did
+    post_ids = sorted({each_post_id for _, each_post_id in events})
+    like_count = select(func.count()).where(PostLike.__table__.c.post_id == Post.__table__.c.id) \
+        .scalar_subquery()
+    connection.execute(
+        update(Post.__table__).where(Post.__table__.c.id.in_(post_ids))
+        .values(dict(versions.bumped(Post), like_count=like_count)))
+
+
+# request side
+
+# (once per request, every post of a page asks)
+def _acting_user_id():
+    if not has_request_context():
+        return None
+    if 'like_buffer_user_id' not in g:
+        g.like_buffer_user_id = _logged_in_user_id()
+    return g.like_buffer_user_id
+
+
+def _logged_in_user_id():
+    try:
+        # (routes without jwt_required too, like GET /posts/<id>)
+        verify_jwt_in_request(optional=True)
+        user = get_current_user()
+    except (RuntimeError, JWTExtendedException, PyJWTError):
+        # (no logged in user in this request)
+        return None
+    return user.id if user is not None else None
+
+
+# liked or not, as the user sees it (their waiting event, else the table)
+def liked(user_id, post_id):
+    from .models import PostLike
+
+    waiting = buffer.waiting(user_id, post_id)
+    if waiting is not None:
+        return waiting
+    return db.session.query(exists().where(PostLike.user_id == user_id, PostLike.post_id == post_id)).scalar()
+
+
+# like (liked=True) or unlike, returns (changed, like count) like app/likes.py does
+# (like count of the post, liked by the user in the table), no row without such a post
+# (built once, it runs for every like)
+@lru_cache(maxsize=None)
+def _state():
+    from .models import Post, PostLike
+
+    return select(
+        Post.__table__.c.like_count,
+        exists().where(PostLike.__table__.c.user_id == bindparam('liker_id'),
+                       PostLike.__table__.c.post_id == Post.__table__.c.id)
+    ).where(Post.__table__.c.id == bindparam('liked_post_id'))
+
+
+def record(user_id, post_id, liked):
+    row = db.session.execute(_state(), {'liker_id': user_id, 'liked_post_id': post_id}).first()
+    if row is None:
+        return False, None
+
+    like_count, liked_in_table = row
+    waiting = buffer.waiting(user_id, post_id)
+    liked_before = liked_in_table if waiting is None else waiting
+
+    buffer.start(db.engine, current_app.config['LIKE_BUFFER_FLUSH_MS'], current_app.config['LIKE_BUFFER_MAX_EVENTS'],
+                 current_app.config['LIKE_BUFFER_KEEP_ACTIONS_SECONDS'])
+    buffer.add(user_id, post_id, liked)
+    return liked != liked_before, like_count + int(liked) - int(liked_in_table)
+
+
+# likes of a post (loaded from the table) and its like count, as the logged in user should see
+# them (with their own waiting event). a waiting like has no row and no id yet, it shows up with
+# the id -<user id> (the same in every response until the flush, never the id of a real like)
+def own_view(post_id, post_likes, like_count):
+    if buffer.is_empty() or not enabled():
+        return post_likes, like_count
+    user_id = _acting_user_id()
+    waiting = None if user_id is None else buffer.waiting(user_id, post_id)
+    if waiting is None:
+        return post_likes, like_count
+
+    from .models import PostLike
+
+    liked_in_table = any(each_like.user_id == user_id for each_like in post_likes)
+    if waiting and not liked_in_table:
+        return post_likes + [PostLike(id=-user_id, user_id=user_id, post_id=post_id)], like_count + 1
+    if not waiting and liked_in_table:
+        return [each_like for each_like in post_likes if each_like.user_id != user_id], like_count - 1
+    return post_likes, like_count
+
+
+# waiting events of the logged in user on these posts (part of their ETags)
+def own_marker(post_ids):
+    if buffer.is_empty() or not enabled():
+        return ()
+    user_id = _acting_user_id()
+    if user_id is None:
+        return ()
+    return tuple((each_id, buffer.waiting(user_id, each_id)) for each_id in post_ids
+                 if buffer.waiting(user_id, each_id) is not None)
+
+
+# likes per second written with a transaction per like (like PUT / DELETE without the buffer)
+# and through the buffer, `threads` writers liking and unliking `hot_posts` posts.
+# runs on a temporary database with the sqlite pragmas of the app (see `flask benchmark-likes`)
+def benchmark(app, events=5000, threads=8, hot_posts=5, users=1000, flush_ms=50, max_events=1000):
+    from .database import _set_pragmas
+    from .models import LikeAction, Post, PostLike, User
+
+    directory = tempfile.mkdtemp()
+    try:
+        # (pooled connections, like the app in production)
+        engine = create_engine('sqlite:///' + os.path.join(directory, 'likes.sqlite'),
+                               poolclass=QueuePool, pool_size=threads,
+                               connect_args={'check_same_thread': False, 'timeout': 30})
+        if app.config['SQLITE_PRAGMAS']:
+            event.listen(engine, 'connect', _set_pragmas(app.config['SQLITE_PRAGMAS']))
+        db.Model.metadata.create_all(engine, tables=[User.__table__, Post.__table__, PostLike.__table__,
+                                                       LikeAction.__table__])
+        with engine.begin() as connection:
+            connection.execute(insert(User.__table__), [
+                {'id': each_id, 'username': 'user%d' % each_id} for each_id in range(1, users + 1)])
+            connection.execute(insert(Post.__table__), [
+                {'id': each_id, 'author_id': 1} for each_id in range(1, hot_posts + 1)])
+
+        taps = [(random.randint(1, users), random.randint(1, hot_posts), random.random() < 0.7)
+                for _ in range(events)]
+        add_likes, remove_likes = _statements()
+
+        # (both sides run the statements app/likes.py runs for a like, reads included)
+        def one_transaction_each(taps):
+            for user_id, post_id, liked in taps:
+                with engine.begin() as connection:
+                    params = {'liker_id': user_id, 'liked_post_id': post_id}
+                    changed = connection.execute(add_likes if liked else remove_likes, params).rowcount
+                    if changed:
+                        connection.execute(
+                            update(Post.__table__).where(Post.__table__.c.id == post_id)
+                            .values(like_count=Post.__table__.c.like_count + (1 if liked else -1)))
+                    connection.execute(select(Post.__table__.c.like_count).where(Post.__table__.c.id == post_id)).scalar()
+
+        like_buffer = LikeBuffer()
+
+        def buffered(taps):
+            for user_id, post_id, liked in taps:
+                # (the read of record())
+                with engine.connect() as connection:
+                    connection.execute(_state(), {'liker_id': user_id, 'liked_post_id': post_id}).first()
+                like_buffer.add(user_id, post_id, liked)
+
+        def run(writer, done=None):
+            started = time.perf_counter()
+            workers = [threading.Thread(target=writer, args=(taps[each::threads],)) for each in range(threads)]
+            for each_worker in workers:
+                each_worker.start()
+            for each_worker in workers:
+                each_worker.join()
+            if done is not None:
+                done()
+            return events / (time.perf_counter() - started)
+
+        results = {'transaction per like': run(one_transaction_each)}
+
+        with engine.begin() as connection:
+            connection.execute(delete(PostLike.__table__))
+            connection.execute(update(Post.__table__).values(like_count=0))
+        like_buffer.start(engine, flush_ms, max_events)
+        results['buffered'] = run(buffered, done=like_buffer.flush)
+        like_buffer.stop()
+
+        with engine.connect() as connection:
+            counted = connection.execute(select(func.count()).select_from(PostLike.__table__)).scalar()
+            like_counts = connection.execute(select(func.sum(Post.__table__.c.like_count))).scalar()
+        assert counted == like_counts
+        engine.dispose()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
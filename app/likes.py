@@ -0,0 +1,56 @@
+from sqlalchemy import delete, literal, select
+from sqlalchemy.dialects.sqlite import insert
+from . import counters
+from . import db
+from . import like_buffer
+
+# like / unlike (PUT and DELETE /posts/<id>/like), with LIKE_BUFFER_ENABLED the events are
+# written a little later, in batches (app/like_buffer.py)
+# one statement against uq_postlikes_user_id_post_id does the work: the insert is ignored when
+# the like is already there (or the post is not), the delete removes nothing when it is not.
+# only when a row really changed the like_count of the post is updated, so repeating a request
+# (double tap, retry) changes nothing, no need to look the like up first.
+#
+# like app/inbox.py these functions only add statements to the session, the caller commits.
+
+
+# returns the like count of the post, None if there is no such post
+def _like_count(post_id):
+    from .models import Post
+
+    return db.session.query(Post.like_count).filter(Post.id == post_id).scalar()
+
+
+# returns (liked now, like count), like count is None if there is no such post
+def like(user_id, post_id):
+    from .models import Post, PostLike
+
+    if like_buffer.enabled():
+        return like_buffer.record(user_id, post_id, True)
+
+    # (insert ... select, so nothing gets inserted for a post which does not exist)
+    statement = insert(PostLike).from_select(
+        ['user_id', 'post_id'],
+        select(literal(user_id), Post.id).where(Post.id == post_id)
+    ).on_conflict_do_nothing(index_elements=['user_id', 'post_id'])
+
+    added = db.session.execute(statement).rowcount == 1
+    if added:
+        counters.add_many(Post, [post_id], 'like_count')
+    return added, _like_count(post_id)
+
+
+# returns (unliked now, like count), like count is None if there is no such post
+def unlike(user_id, post_id):
+    from .models import Post, PostLike
+
+    if like_buffer.enabled():
+        return like_buffer.record(user_id, post_id, False)
+
+    removed = db.session.execute(delete(PostLike).where(
+        PostLike.user_id == user_id,
+        PostLike.post_id == post_id
+    ).execution_options(synchronize_session=False)).rowcount == 1
+    if removed:
+        counters.add_many(Post, [post_id], 'like_count', -1)
+    return removed, _like_count(post_id)
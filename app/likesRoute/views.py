@@ -1,12 +1,46 @@
 
 from flask import jsonify, request
 from flask_jwt_extended import current_user, jwt_required
+from sqlalchemy.exc import IntegrityError
 from ..models import Post, PostLike
+from .. import counters
 from .. import db
+from .. import like_buffer
+from .. import likes
+from .. import loaders
 from . import likesRoute
 from app.postRoute.errors import custom404, bad_request
 
 
+# like (PUT) or unlike (DELETE) a post, repeating a request changes nothing
+# answers with the like count only, the whole post comes with ?include=post
+@likesRoute.route('/posts/<int:id>/like', methods=['PUT'])
+@jwt_required()
+def like_post(id):
+    _, like_count = likes.like(current_user.id, id)
+    return _like_response(id, like_count, True)
+
+
+@likesRoute.route('/posts/<int:id>/like', methods=['DELETE'])
+@jwt_required()
+def unlike_post(id):
+    _, like_count = likes.unlike(current_user.id, id)
+    return _like_response(id, like_count, False)
+
+
+def _like_response(post_id, like_count, liked_by_me):
+    if like_count is None:
+        # (a real 404 whatever the client accepts, retrying clients go by the status code)
+        return jsonify({"msg": "Post not found."}), 404
+    db.session.commit()
+
+    response = {"post_id": post_id, "like_count": like_count, "liked_by_me": liked_by_me}
+    if request.args.get('include') == 'post':
+        response["post"] = loaders.prime_posts([Post.query.get(post_id)])[0].to_json()
+    return jsonify(response), 200
+
+
+# toggle (the PUT / DELETE ones above are cheaper)
 @likesRoute.route('/like_unlike/<int:id>/')
 @jwt_required()
 def like_or_unlike(id): # id of post to like or unlike
@@ -16,17 +50,31 @@ def like_or_unlike(id): # id of post to like or unlike
     if not located_post:
         return custom404("Post not found.")
 
+    # (the like may still be waiting in the buffer, app/like_buffer.py)
+    if like_buffer.enabled():
+        if like_buffer.liked(current_user.id, id):
+            likes.unlike(current_user.id, id)
+            return jsonify({ "msg": "Post Unliked", "post_id": id, "updated_post": Post.query.get(id).to_json() }), 200
+        likes.like(current_user.id, id)
+        return jsonify({ "msg": "Post Liked", "post_id": id, "updated_post": Post.query.get(id).to_json() }), 200
+
     find_like = PostLike.query.filter_by(user_id=current_user.id, post_id=id).first()
 
     # if liked already then we will remove the liked entry (means unlike)
     if find_like:
         db.session.delete(find_like)
+        counters.add(located_post, 'like_count', -1)
         db.session.commit()
         return jsonify({ "msg": "Post Unliked", "post_id": id, "updated_post": Post.query.get(id).to_json() }), 200
 
 
     new_like = PostLike(user_like_backref=current_user, post_like_backref=located_post)
     db.session.add(new_like)
-    db.session.commit()
+    counters.add(located_post, 'like_count')
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # (a double tap, the other request added the like first, uq_postlikes_user_id_post_id)
+        db.session.rollback()
 
     return jsonify({ "msg": "Post Liked", "post_id": id, "updated_post": Post.query.get(id).to_json() }), 200
\ No newline at end of file
@@ -0,0 +1,255 @@
+from flask import g, has_app_context
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from . import pagination
+
+# request scoped batch loaders
+# serializers (to_json, msg_json etc.) ask a loader for a row instead of running Model.query.get()
+# once per row, ids are collected with prime() and fetched together with a single IN (...) query
+# the first time any of them is needed. loaded rows are kept on flask.g, so they live exactly
+# as long as the request (app context) does and every serializer in that request shares them.
+
+# sqlite refuses statements with too many bound parameters, so big id lists are split up
+IN_CHUNK_SIZE = 500
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), IN_CHUNK_SIZE):
+        yield values[start:start + IN_CHUNK_SIZE]
+
+
+class EntityLoader:
+    # one row per primary key (example: users, roles)
+
+    def __init__(self, model):
+        self.model = model
+        self.cache = {}
+        self.pending = set()
+
+    def prime(self, ids):
+        for each_id in ids:
+            if each_id is not None and each_id not in self.cache:
+                self.pending.add(each_id)
+        return self
+
+    # rows the caller already has in hand (example: User.query.all() in a listing view)
+    def add(self, rows):
+        for each_row in rows:
+            self.cache[each_row.id] = each_row
+            self.pending.discard(each_row.id)
+        return self
+
+    def flush(self):
+        if not self.pending:
+            return self
+
+        ids = list(self.pending)
+        self.pending.clear()
+
+        for each_chunk in _chunks(ids):
+            for each_row in self.model.query.filter(self.model.id.in_(each_chunk)).all():
+                self.cache[each_row.id] = each_row
+
+        # remembering the misses as well, so a missing id is not queried again
+        for each_id in ids:
+            self.cache.setdefault(each_id, None)
+
+        return self
+
+    def get(self, id):
+        if id is None:
+            return None
+        if id not in self.cache:
+            self.prime([id])
+        # also loads every other id primed so far (in the same query)
+        self.flush()
+        return self.cache[id]
+
+    def get_many(self, ids):
+        ids = list(ids)
+        self.prime(ids).flush()
+        return [self.cache[each_id] for each_id in ids if self.cache.get(each_id) is not None]
+
+
+class GroupLoader:
+    # many rows per foreign key (example: likes or comments of a post)
+    # with a limit only the first `limit` rows (in order_by order) of every group are loaded
+
+    def __init__(self, model, column, order_by=None, limit=None):
+        self.model = model
+        self.column = column
+        self.order_by = order_by
+        self.limit = limit
+        self.cache = {}
+        self.pending = set()
+
+    def prime(self, keys):
+        for each_key in keys:
+            if each_key is not None and each_key not in self.cache:
+                self.pending.add(each_key)
+        return self
+
+    def flush(self):
+        if not self.pending:
+            return self
+
+        keys = list(self.pending)
+        self.pending.clear()
+
+        for each_key in keys:
+            self.cache[each_key] = []
+
+        for each_chunk in _chunks(keys):
+            if self.limit is None:
+                query = self.model.query.filter(self.column.in_(each_chunk))
+            else:
+                query = self._first_rows_query(each_chunk)
+            if self.order_by is not None:
+                query = query.order_by(*self.order_by)
+            # rows come back in the requested order, so every group keeps that order
+            for each_row in query.all():
+                self.cache[getattr(each_row, self.column.key)].append(each_row)
+
+        return self
+
+    # numbering the rows of every group with a window function and keeping the first ones,
+    # that way "first page of every user" is still a single query
+    def _first_rows_query(self, keys):
+        rank = func.row_number().over(partition_by=self.column, order_by=self.order_by).label('rank')
+        ranked = self.model.query.with_entities(self.model.id, rank) \
+            .filter(self.column.in_(keys)).subquery()
+
+        return self.model.query.join(ranked, ranked.c.id == self.model.id) \
+            .filter(ranked.c.rank <= self.limit)
+
+    def get(self, key):
+        if key not in self.cache:
+            self.prime([key])
+        self.flush()
+        return self.cache[key]
+
+
+def _loader(name, factory):
+    loaders = g.setdefault('_batch_loaders', {})
+    if name not in loaders:
+        loaders[name] = factory()
+    return loaders[name]
+
+
+def reset():
+    if has_app_context():
+        g.pop('_batch_loaders', None)
+
+
+def users():
+    from .models import User
+    return _loader('users', lambda: EntityLoader(User))
+
+
+def messages():
+    from .models import Message
+    return _loader('messages', lambda: EntityLoader(Message))
+
+
+def post_likes():
+    from .models import PostLike
+    return _loader('post_likes', lambda: GroupLoader(
+        PostLike, PostLike.post_id, order_by=[PostLike.id]))
+
+
+def post_comments():
+    from .models import Comment
+    # ordered by latest comments (same as Post.to_json always did)
+    return _loader('post_comments', lambda: GroupLoader(
+        Comment, Comment.post_id, order_by=[Comment.timestamp.desc(), Comment.id.desc()]))
+
+
+# newest posts of every user, `limit` rows at most per user (the first page of a profile)
+def user_posts(limit):
+    from .models import Post
+    return _loader('user_posts:%d' % limit, lambda: GroupLoader(
+        Post, Post.author_id, order_by=pagination.newest_first(pagination.cursor_keys(Post)), limit=limit))
+
+
+def user_followers():
+    from .models import Follow
+    return _loader('user_followers', lambda: GroupLoader(
+        Follow, Follow.following_to, order_by=[Follow.timestamp]))
+
+
+def user_following():
+    from .models import Follow
+    return _loader('user_following', lambda: GroupLoader(
+        Follow, Follow.follower_id, order_by=[Follow.timestamp]))
+
+
+# priming helpers, views call these with the whole result set before serializing it
+
+def prime_users(ids):
+    return users().get_many(ids)
+
+
+# everything User.to_json needs (followers, following and first page of posts) for a whole list
+# of users, posts_limit is the page size (one extra post is loaded to know if there are more)
+# (posts_limit=None skips the posts, for when the caller asks for a later page anyway)
+def prime_profiles(user_list, posts_limit=None):
+    users().add(user_list)
+    user_ids = [each_user.id for each_user in user_list]
+
+    followers_loader = user_followers().prime(user_ids).flush()
+    following_loader = user_following().prime(user_ids).flush()
+
+    related_ids = set(user_ids)
+    posts = []
+    for each_id in user_ids:
+        related_ids.update(each_follow.follower_id for each_follow in followers_loader.get(each_id))
+        related_ids.update(each_follow.following_to for each_follow in following_loader.get(each_id))
+
+    if posts_limit is not None:
+        posts_loader = user_posts(posts_limit + 1).prime(user_ids).flush()
+        for each_id in user_ids:
+            posts += posts_loader.get(each_id)
+
+    users().prime(related_ids)
+    prime_posts(posts)
+    return user_list
+
+
+def prime_posts(posts):
+    post_ids = [each_post.id for each_post in posts]
+    likes_loader = post_likes().prime(post_ids).flush()
+    comments_loader = post_comments().prime(post_ids).flush()
+
+    user_ids = set()
+    for each_post in posts:
+        user_ids.add(each_post.author_id)
+        user_ids.update(each_like.user_id for each_like in likes_loader.get(each_post.id))
+        user_ids.update(each_comm.author_id for each_comm in comments_loader.get(each_post.id))
+
+    prime_users(user_ids)
+    return posts
+
+
+def prime_messages(messages):
+    user_ids = set()
+    for each_msg in messages:
+        user_ids.add(each_msg.sent_by)
+        user_ids.add(each_msg.sent_for)
+
+    users().prime(user_ids).flush()
+    return messages
+
+
+def prime_conversations(conversations):
+    found_messages = messages().get_many([each_conv.last_message_id for each_conv in conversations])
+    prime_messages(found_messages)
+    users().prime([each_conv.other_user_id for each_conv in conversations]).flush()
+    return conversations
+
+
+# a commit can change any of the rows held above (new likes, renamed users ...), so whatever
+# the loaders hold is dropped and the next serializer in the request loads fresh data
+@event.listens_for(Session, 'after_commit')
+def _reset_after_commit(session):
+    reset()
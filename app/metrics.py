@@ -0,0 +1,329 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, request
+from . import query_stats
+
+try:
+    import fcntl
+except ImportError:
+    # (windows, no gunicorn there, one process)
+    fcntl = None
+
+# request metrics (METRICS_ENABLED), in prometheus text format on GET /metrics (admins only)
+# per endpoint: request latency histogram, requests per method and status, requests in flight,
+# time spent in the database (app/query_stats.py) and bytes sent.
+#
+# every worker counts its own requests in memory (a few dict updates per request, latencies go
+# into the fixed BUCKETS), and writes them to METRICS_DIR/<pid>.json every METRICS_WRITE_SECONDS
+# (and when it exits). the worker answering /metrics adds up its own counters and the files of
+# the other workers, so the numbers are the ones of the whole gunicorn server (the other workers
+# up to METRICS_WRITE_SECONDS old).
+# the counters of exited workers are added to METRICS_DIR/exited.json and their files removed (by
+# the writing threads of the live workers), so their requests stay counted, the directory does
+# not grow with every recycled worker, and a new worker with the pid of an exited one does not
+# overwrite its counts (a counter going down looks like a restart to prometheus).
+# METRICS_DIR is emptied when the server starts (on_starting in gunicorn.conf.py).
+
+# upper bounds (seconds) of the latency buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class WorkerMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter()  # (endpoint, method, status) => requests
+        self.latency = {}  # endpoint => [requests per bucket ..., above the last bucket, seconds]
+        self.db_seconds = Counter()
+        self.response_bytes = Counter()
+        self.in_flight = Counter()
+
+    def started(self, endpoint):
+        with self.lock:
+            self.in_flight[endpoint] += 1
+
+    def finished(self, endpoint, method, status, seconds, db_seconds):
+        with self.lock:
+            self.in_flight[endpoint] -= 1
+            self.requests[(endpoint, method, status)] += 1
+            buckets = self.latency.get(endpoint)
+            if buckets is None:
+                buckets = self.latency[endpoint] = [0] * (len(BUCKETS) + 1) + [0.0]
+            buckets[bisect_left(BUCKETS, seconds)] += 1
+            buckets[-1] += seconds
+            self.db_seconds[endpoint] += db_seconds
+
+    def sent(self, endpoint, size):
+        with self.lock:
+            self.response_bytes[endpoint] += size
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'requests': [list(each_key) + [each_count] for each_key, each_count in self.requests.items()],
+                'latency': {each_endpoint: list(each_buckets) for each_endpoint, each_buckets in self.latency.items()},
+                'db_seconds': dict(self.db_seconds),
+                'response_bytes': dict(self.response_bytes),
+                'in_flight': dict(self.in_flight)
+            }
+
+
+worker = WorkerMetrics()
+
+
+EXITED = 'exited.json'
+
+
+def _path(directory, pid):
+    return os.path.join(directory, '%d.json' % pid)
+
+
+# one process folding files at a time, and nobody reading while it does
+@contextmanager
+def _locked(directory, exclusive):
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _replace(path, data):
+    with open(path + '.tmp', 'w') as file:
+        json.dump(data, file)
+    # (readers never see half a file)
+    os.replace(path + '.tmp', path)
+
+
+# pids of the files of the workers
+def _pids(directory):
+    return [int(each_name[:-5]) for each_name in os.listdir(directory)
+            if each_name.endswith('.json') and each_name[:-5].isdigit()]
+
+
+def write(directory):
+    snapshot = worker.snapshot()
+    _replace(_path(directory, snapshot['pid']), snapshot)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _empty():
+    return {'requests': Counter(), 'latency': {}, 'db_seconds': Counter(),
+            'response_bytes': Counter(), 'in_flight': Counter()}
+
+
+def _add(total, snapshot, in_flight=True):
+    for endpoint, method, status, count in snapshot['requests']:
+        total['requests'][(endpoint, method, status)] += count
+    for each_endpoint, each_buckets in snapshot['latency'].items():
+        buckets = total['latency'].setdefault(each_endpoint, [0] * len(each_buckets))
+        for each_index, each_value in enumerate(each_buckets):
+            buckets[each_index] += each_value
+    total['db_seconds'].update(snapshot['db_seconds'])
+    total['response_bytes'].update(snapshot['response_bytes'])
+    if in_flight:
+        total['in_flight'].update(snapshot['in_flight'])
+
+
+# adds the files of the workers `exited(pid)` says are gone to exited.json, and removes them
+def _fold(directory, exited):
+    with _locked(directory, exclusive=True):
+        pids = [each_pid for each_pid in _pids(directory) if exited(each_pid)]
+        if not pids:
+            return
+        total = _empty()
+        exited_path = os.path.join(directory, EXITED)
+        for each_path in [exited_path] + [_path(directory, each_pid) for each_pid in pids]:
+            snapshot = _read(each_path)
+            if snapshot is not None:
+                _add(total, snapshot, in_flight=False)
+        _replace(exited_path, {
+            'pid': None,
+            'requests': [list(each_key) + [each_count] for each_key, each_count in total['requests'].items()],
+            'latency': total['latency'],
+            'db_seconds': dict(total['db_seconds']),
+            'response_bytes': dict(total['response_bytes']),
+            'in_flight': {}
+        })
+        for each_pid in pids:
+            os.remove(_path(directory, each_pid))
+
+
+# counters of this worker, of the files of the other ones and of the exited ones, added up
+def merged(directory):
+    total = _empty()
+    _add(total, worker.snapshot())
+    if os.path.isdir(directory):
+        with _locked(directory, exclusive=False):
+            exited = _read(os.path.join(directory, EXITED))
+            if exited is not None:
+                _add(total, exited, in_flight=False)
+            for each_pid in _pids(directory):
+                if each_pid == os.getpid():
+                    continue
+                snapshot = _read(_path(directory, each_pid))
+                if snapshot is not None:
+                    _add(total, snapshot, in_flight=_is_running(each_pid))
+    return total
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (each_name, escape(each_value))
+                             for each_name, each_value in labels.items())
+
+
+# prometheus text format of the merged counters
+def render(directory):
+    total = merged(directory)
+    lines = []
+
+    lines.append('# HELP http_requests_total Requests by endpoint, method and status.')
+    lines.append('# TYPE http_requests_total counter')
+    for (endpoint, method, status), count in sorted(total['requests'].items()):
+        lines.append('http_requests_total%s %d' % (_labels(endpoint=endpoint, method=method, status=status), count))
+
+    lines.append('# HELP http_request_duration_seconds Request latency by endpoint.')
+    lines.append('# TYPE http_request_duration_seconds histogram')
+    for endpoint, buckets in sorted(total['latency'].items()):
+        cumulative = 0
+        for each_bound, each_count in zip(BUCKETS + ('+Inf',), buckets[:-1]):
+            cumulative += each_count
+            lines.append('http_request_duration_seconds_bucket%s %d' % (_labels(endpoint=endpoint, le=each_bound), cumulative))
+        lines.append('http_request_duration_seconds_sum%s %.6f' % (_labels(endpoint=endpoint), buckets[-1]))
+        lines.append('http_request_duration_seconds_count%s %d' % (_labels(endpoint=endpoint), cumulative))
+
+    lines.append('# HELP http_requests_in_flight Requests being handled right now, by endpoint.')
+    lines.append('# TYPE http_requests_in_flight gauge')
+    for endpoint, count in sorted(total['in_flight'].items()):
+        lines.append('http_requests_in_flight%s %d' % (_labels(endpoint=endpoint), count))
+
+    lines.append('# HELP http_request_db_seconds_total Time spent in sql queries, by endpoint.')
+    lines.append('# TYPE http_request_db_seconds_total counter')
+    for endpoint, seconds in sorted(total['db_seconds'].items()):
+        lines.append('http_request_db_seconds_total%s %.6f' % (_labels(endpoint=endpoint), seconds))
+
+    lines.append('# HELP http_response_bytes_total Bytes of response bodies, by endpoint.')
+    lines.append('# TYPE http_response_bytes_total counter')
+    for endpoint, size in sorted(total['response_bytes'].items()):
+        lines.append('http_response_bytes_total%s %d' % (_labels(endpoint=endpoint), size))
+
+    return '\n'.join(lines) + '\n'
+
+
+# removes the counters of earlier runs (once, before the workers start, gunicorn.conf.py)
+def clear(directory):
+    if os.path.isdir(directory):
+        for each_name in os.listdir(directory):
+            if each_name.endswith('.json'):
+                os.remove(os.path.join(directory, each_name))
+
+
+# starts writing the counters of this process (again after a fork, a new worker starts at zero)
+def _start(directory, seconds):
+    with worker.lock:
+        if worker.pid == os.getpid():
+            return
+        worker.pid = os.getpid()
+        worker.reset()
+    os.makedirs(directory, exist_ok=True)
+    # (a file with the pid of this process is the one of an exited worker)
+    pid = os.getpid()
+    _fold(directory, lambda each_pid: each_pid == pid)
+
+    def write_every():
+        while True:
+            time.sleep(seconds)
+            try:
+                write(directory)
+                _fold(directory, lambda each_pid: each_pid != pid and not _is_running(each_pid))
+            except OSError:
+                pass
+
+    threading.Thread(target=write_every, daemon=True).start()
+    atexit.register(write, directory)
+
+
+def _endpoint():
+    return request.endpoint or 'none'
+
+
+# streamed bodies (app/streaming.py) are counted once they are sent
+def _counting(chunks, endpoint):
+    size = 0
+    try:
+        for each_chunk in chunks:
+            size += len(each_chunk.encode() if isinstance(each_chunk, str) else each_chunk)
+            yield each_chunk
+    finally:
+        worker.sent(endpoint, size)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def init_app(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    # (database time of every request)
+    query_stats.collect(app)
+    directory = app.config['METRICS_DIR']
+
+    @app.before_request
+    def start_request():
+        _start(directory, app.config['METRICS_WRITE_SECONDS'])
+        g.metrics_started = time.perf_counter()
+        worker.started(_endpoint())
+
+    @app.after_request
+    def count_response(response):
+        g.metrics_status = response.status_code
+        if response.is_streamed:
+            response.response = _counting(response.response, _endpoint())
+        else:
+            worker.sent(_endpoint(), response.content_length or 0)
+        return response
+
+    @app.teardown_request
+    def finish_request(exception):
+        started = g.get('metrics_started')
+        if started is None:
+            return
+        stats = g.get('query_stats')
+        worker.finished(
+            _endpoint(), request.method, g.get('metrics_status', 500),
+            time.perf_counter() - started, stats.seconds if stats is not None else 0.0)
@@ -1,8 +1,18 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from . import db
+from . import follow_graph
 from . import jwt
+from . import blocklist
+from . import counters
+from . import like_buffer
+from . import loaders
+from . import pagination
+from . import passwords
+from . import role_registry
+from . import timeline
+from . import user_cache
 from flask import jsonify, current_app, abort
+from sqlalchemy import delete
 
 # scalar()
 """
@@ -28,8 +38,8 @@ class TokenBlocklist(db.Model):
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_header, jwt_payload: dict) -> bool:
     jti = jwt_payload["jti"]
-    token = db.session.query(TokenBlocklist.id).filter_by(jti=jti).scalar()
-    return token is not None
+    # (checked in memory, see app/blocklist.py)
+    return blocklist.is_revoked(jti)
 
 
 # Follow model table representation
@@ -57,6 +67,23 @@ class Follow(db.Model):
     # time when they got followed/started following
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # (the primary key only helps with "who does A follow", this one with "who follows B")
+    __table_args__ = (
+        db.Index('ix_follows_following_to_follower_id', 'following_to', 'follower_id'),
+    )
+
+
+# log of the changes to follows, for the in-memory follow graph of every worker (app/follow_graph.py)
+class FollowEvent(db.Model):
+    __tablename__ = 'follow_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # follow, unfollow or remove_user (then following_to is empty)
+    action = db.Column(db.String(20), nullable=False)
+    follower_id = db.Column(db.Integer, nullable=False)
+    following_to = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -69,25 +96,97 @@ class Message(db.Model):
     shared_post_path = db.Column(db.String(200))
     shared_post_of_username = db.Column(db.String(200))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    # set once the recipient opened the conversation
+    read = db.Column(db.Boolean, default=False, server_default='0', nullable=False)
+
+    # messages between two users (in one direction) in time order, see conversation()
+    # (also the messages sent by a user), and the messages received by a user
+    __table_args__ = (
+        db.Index('ix_messages_sent_by_sent_for_timestamp', 'sent_by', 'sent_for', 'timestamp'),
+        db.Index('ix_messages_sent_for_timestamp', 'sent_for', 'timestamp'),
+    )
 
     def __repr__(self):
         return '<Message %r>' % self.body
 
+    # a page of the messages between two users (newest first), returns (messages, next_cursor)
+    # one range scan on ix_messages_sent_by_sent_for_timestamp per direction, both merged by
+    # sqlite in a single query (no sorting of the whole conversation)
+    @staticmethod
+    def conversation(first_user_id, second_user_id, cursor, limit):
+        keys = pagination.cursor_keys(Message)
+
+        def one_direction(sender_id, recipient_id):
+            query = Message.query.filter_by(sent_by=sender_id, sent_for=recipient_id)
+            if cursor is not None:
+                query = pagination.after_cursor(query, keys, cursor)
+            return query
+
+        both_directions = one_direction(first_user_id, second_user_id) \
+            .union_all(one_direction(second_user_id, first_user_id))
+        rows = pagination.fetch_page(both_directions, keys, None, limit)
+
+        return pagination.split_page(rows, limit)
+
     def msg_json(self):
 
-        user_details = User.query.get(self.sent_for)        
+        user_details = loaders.users().prime([self.sent_by, self.sent_for]).get(self.sent_for)
 
         json_response = {
             'message_id': self.id,
             'sender': self.sent_by,
             'recipient_id': self.sent_for,
             'recipient_name': user_details.username,
-            'sender_name': User.query.get(self.sent_by).username,
+            'sender_name': loaders.users().get(self.sent_by).username,
             'shared_status': self.shared_message,
             'shared_post_path': self.shared_post_path,
             'shared_post_of_username': self.shared_post_of_username,
             'body': self.body,
-            'sent_on': self.timestamp
+            'sent_on': self.timestamp,
+            'read': self.read
+        }
+
+        return json_response
+
+
+# inbox of every user, one row per user they chatted with (see app/inbox.py)
+"""
+     _____________________________________________________________________
+    |  owner_id  |  other_user_id  |  last_message_id  |  unread_count  |
+    |     1      |        2        |        9          |       0        |  user 1 sent message 9 to user 2
+    |     2      |        1        |        9          |       1        |  which user 2 did not read yet
+    |____________|_________________|___________________|________________|
+"""
+
+
+class Conversation(db.Model):
+    __tablename__ = 'conversations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    other_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('messages.id'))
+    # time of the last message (last activity), the inbox is ordered on it
+    timestamp = db.Column(db.DateTime, nullable=False)
+    unread_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('owner_id', 'other_user_id', name='uq_conversations_owner_id_other_user_id'),
+        db.Index('ix_conversations_owner_id_timestamp', 'owner_id', 'timestamp'),
+    )
+
+    def inbox_json(self):
+
+        other_user = loaders.users().get(self.other_user_id)
+        last_message = loaders.messages().get(self.last_message_id)
+
+        json_response = {
+            'user_id': self.other_user_id,
+            'username': other_user.username,
+            'profile_image': other_user.user_image_url,
+            'last_message': last_message.msg_json(),
+            'last_activity': self.timestamp,
+            'unread_count': self.unread_count
         }
 
         return json_response
@@ -103,6 +202,16 @@ class User(db.Model):
     username = db.Column(db.String(100), unique=True, index=True)
     user_image_url = db.Column(db.Text)
     password_hash = db.Column(db.String(128))
+    # set for users with too many followers to copy their posts into every follower timeline,
+    # their posts are read straight from the posts table instead (see app/timeline.py)
+    fan_out_on_read = db.Column(db.Boolean, default=False, server_default='0', nullable=False)
+    # counters (see app/counters.py)
+    follower_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    following_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    post_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # content version (see app/versions.py)
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     comments = db.relationship('Comment', backref='author_backref', lazy='dynamic')
     liked = db.relationship('PostLike', backref='user_like_backref', lazy='dynamic')
 
@@ -162,6 +271,10 @@ class User(db.Model):
             follow_data = Follow(follower_backref=self,
                                  following_to_backref=user)
             db.session.add(follow_data)
+            counters.add(self, 'following_count')
+            counters.add(user, 'follower_count')
+            timeline.add_author(self, user)
+            follow_graph.followed(self.id, user.id)
             # to save this data we use db.session.commit() in follow view function (as after commit
             # we need to provide a return statement and that should be handled in views only)
         else:
@@ -174,6 +287,10 @@ class User(db.Model):
                 following_to=user.id).first()
             if user_to_unfollow:
                 db.session.delete(user_to_unfollow)
+                counters.add(self, 'following_count', -1)
+                counters.add(user, 'follower_count', -1)
+                timeline.remove_author(self, user)
+                follow_graph.unfollowed(self.id, user.id)
             else:
                 abort(403, "user not found")
         else:
@@ -190,6 +307,71 @@ class User(db.Model):
             # in current user followed_back list we are looking for a follower
             return self.got_followed_back_list.filter_by(follower_id=user.id).first() is not None
 
+    # follow status between this user and every user in user_ids, with a single query
+    # returns {user_id: {"following": bool, "followed_by": bool, "mutual": bool}}
+    # (both sides of the OR are lookups on the primary key of follows)
+    def relationship_status(self, user_ids):
+        # (in the order of user_ids, duplicates removed)
+        user_ids = list(dict.fromkeys(user_ids))
+        status = {each_id: {"following": False, "followed_by": False, "mutual": False} for each_id in user_ids}
+        if not user_ids:
+            return status
+
+        rows = db.session.query(Follow.follower_id, Follow.following_to).filter(
+            ((Follow.follower_id == self.id) & Follow.following_to.in_(user_ids)) |
+            ((Follow.following_to == self.id) & Follow.follower_id.in_(user_ids))
+        ).all()
+
+        for follower_id, following_to in rows:
+            if follower_id == self.id and following_to in status:
+                status[following_to]["following"] = True
+            if following_to == self.id and follower_id in status:
+                status[follower_id]["followed_by"] = True
+
+        for each_status in status.values():
+            each_status["mutual"] = each_status["following"] and each_status["followed_by"]
+        return status
+
+    # following many users in one go (onboarding), users which are already followed are skipped
+    # returns the users which got followed
+    def follow_many(self, users):
+        status = self.relationship_status([each_user.id for each_user in users])
+        new_users = [each_user for each_user in users if not status[each_user.id]["following"]]
+        # (the same user twice in the list gets followed once)
+        new_users = list({each_user.id: each_user for each_user in new_users}.values())
+        if not new_users:
+            return []
+
+        for each_user in new_users:
+            db.session.add(Follow(follower_backref=self, following_to_backref=each_user))
+        counters.add(self, 'following_count', len(new_users))
+        counters.add_many(User, [each_user.id for each_user in new_users], 'follower_count')
+        timeline.add_authors(self, new_users)
+        for each_user in new_users:
+            follow_graph.followed(self.id, each_user.id)
+        return new_users
+
+    # unfollowing many users in one go, users which are not followed are skipped
+    # returns the users which got unfollowed
+    def unfollow_many(self, users):
+        status = self.relationship_status([each_user.id for each_user in users])
+        followed_users = [each_user for each_user in users if status[each_user.id]["following"]]
+        followed_users = list({each_user.id: each_user for each_user in followed_users}.values())
+        if not followed_users:
+            return []
+
+        followed_ids = [each_user.id for each_user in followed_users]
+        db.session.execute(delete(Follow).where(
+            Follow.follower_id == self.id,
+            Follow.following_to.in_(followed_ids)
+        ).execution_options(synchronize_session=False))
+        counters.add(self, 'following_count', -len(followed_users))
+        counters.add_many(User, followed_ids, 'follower_count', -1)
+        timeline.remove_authors(self, followed_users)
+        for each_id in followed_ids:
+            follow_graph.unfollowed(self.id, each_id)
+        return followed_users
+
     # def followers_to_json(self):
     #     json_follower = {
     #         "username": self.username
@@ -202,74 +384,96 @@ class User(db.Model):
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
+        # (roles come from the registry, see app/role_registry.py)
         if self.email == current_app.config['APP_ADMIN']:
-            self.role = Role.query.filter_by(name='Administrator').first()
-        if self.role == None:
-            self.role = Role.query.filter_by(default=True).first()
+            admin_role = role_registry.named('Administrator')
+            self.role_id = admin_role.id if admin_role is not None else None
+        if self.role_id is None and self.role is None:
+            default_role = role_registry.default_role()
+            self.role_id = default_role.id if default_role is not None else None
 
     # making password un-readable (if someone tries to read its value)
     @property
     def password(self):
         raise AttributeError('password is not a readable attribute')
 
+    # (hashed in the pool of app/passwords.py)
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash_password(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify_password(self.password_hash, password)
+
+    # password was hashed with older settings (method or iterations changed in config)
+    def password_needs_rehash(self):
+        return passwords.needs_rehash(self.password_hash)
 
     def check_permission_exists_in_user(self, perm):  # for current user role
-        return self.role is not None and self.role.has_permission(perm)
+        role = role_registry.get(self.role_id)
+        return role is not None and role.has_permission(perm)
 
     def is_administrator(self):
         return self.check_permission_exists_in_user(Permission.ADMIN)
 
-    def to_json(self):
+    # posts are paginated (newest first), without a cursor the first page is returned
+    def to_json(self, posts_cursor=None, posts_limit=None):
 
-        role_name = ""
-        if self.role_id is not None:
-            get_role = Role.query.get(self.role_id)
-            role_name = get_role.name
+        posts_limit = posts_limit or current_app.config['POSTS_PER_PAGE']
+
+        role_name = role_registry.role_name(self.role_id)
 
         followers_data = []
         following_to_data = []
 
-        user_followers = self.got_followed_back_list.all()
-        user_followed = self.following_to_list.all()
+        # (a no-op when the view already primed the loaders with the whole list of users)
+        loaders.prime_profiles([self], None if posts_cursor else posts_limit)
+        user_followers = loaders.user_followers().get(self.id)
+        user_followed = loaders.user_following().get(self.id)
 
         for each_follower in user_followers:
-            locate_user = User.query.get(each_follower.follower_id)
+            locate_user = loaders.users().get(each_follower.follower_id)
             followers_data.append({
                 "user_id": locate_user.id,
                 "username": locate_user.username
             })
 
         for each_user in user_followed:
-            locate_user = User.query.get(each_user.following_to)
+            locate_user = loaders.users().get(each_user.following_to)
             following_to_data.append({
                 "user_id": locate_user.id,
                 "username": locate_user.username
             })
 
+        if posts_cursor is None:
+            first_posts = loaders.user_posts(posts_limit + 1).get(self.id)
+            posts_page, posts_next_cursor = pagination.split_page(first_posts, posts_limit)
+        else:
+            posts_page, posts_next_cursor = pagination.paginate(
+                self.posts, Post, posts_cursor, posts_limit)
+            loaders.prime_posts(posts_page)
+
         json_user = {
             'user_id': self.id,
             'username': self.username,
             'role_id': self.role_id,
             'followers': followers_data,
             'following': following_to_data,
+            'follower_count': self.follower_count,
+            'following_count': self.following_count,
+            'post_count': self.post_count,
             'role': role_name,
             'profile_image': self.user_image_url,
             'email': self.email,
-            'posts': [each_post.to_json() for each_post in self.posts]
+            'posts': [each_post.to_json() for each_post in posts_page],
+            'posts_next_cursor': posts_next_cursor
         }
 
         return json_user
 
     def less_user_info_json(self):
 
-        get_role = Role.query.get(self.role_id)
-        role_name = get_role.name
+        role_name = role_registry.role_name(self.role_id)
 
         json_data = {
             'user_id': self.id,
@@ -287,7 +491,8 @@ class User(db.Model):
 @jwt.user_lookup_loader
 def user_lookup_callback(_jwt_header, jwt_data):
     identity = jwt_data["user_id"]
-    return User.query.filter_by(id=identity).one_or_none()
+    # (from the in-memory cache when possible, see app/user_cache.py)
+    return user_cache.load_user(identity)
 
 # with user_lookup_error_loader if we try to fetch user data from a deleted user token
 # then below handler will give a custom 404 error user not found and if we do not use the
@@ -312,6 +517,18 @@ class Post(db.Model):
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     comments = db.relationship('Comment', backref='post_backref', lazy='dynamic')
     likes = db.relationship('PostLike', backref='post_like_backref', lazy='dynamic')
+    # counters (see app/counters.py)
+    like_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # content version (see app/versions.py)
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # newest posts of a user (profile pages and followed users posts are paginated on this),
+    # sqlite adds the rowid (id) to every index, so the (timestamp, id) order comes for free
+    __table_args__ = (
+        db.Index('ix_posts_author_id_timestamp', 'author_id', 'timestamp'),
+    )
 
     def __repr__(self):
         return '<Post %r>' % self.body
@@ -320,7 +537,11 @@ class Post(db.Model):
     def to_json(self):
         # where self contains the whole post object
         # print(self.comments.all()) # holds all the comments
-        locate_user = User.query.get(self.author_id)     
+        # (a no-op when the view already primed the loaders with the whole list of posts)
+        loaders.prime_posts([self])
+        locate_user = loaders.users().get(self.author_id)
+        # (likes of the logged in user still waiting in app/like_buffer.py included)
+        post_likes, like_count = like_buffer.own_view(self.id, loaders.post_likes().get(self.id), self.like_count)
 
         # ordered by latest comments
         json_post = {
@@ -329,8 +550,10 @@ class Post(db.Model):
             'uploaded_content_url': self.uploaded_content_url,
             'body': self.body,
             'timestamp': self.timestamp,
-            'likes': [each_like.like_json() for each_like in self.likes],
-            'comments': [each_comm.comment_in_json() for each_comm in self.comments.order_by(Comment.timestamp.desc())]
+            'like_count': like_count,
+            'comment_count': self.comment_count,
+            'likes': [each_like.like_json() for each_like in post_likes],
+            'comments': [each_comm.comment_in_json() for each_comm in loaders.post_comments().get(self.id)]
         }
 
         return json_post
@@ -341,6 +564,35 @@ class Post(db.Model):
     #     return True
 
 
+# home timeline (followed users posts) of every user, filled on write (see app/timeline.py)
+"""
+     ___________________________________________________
+    |  owner_id  |  post_id  |  author_id  |  timestamp  |
+    |     1      |    7      |      2      |   (post 7)  |  post 7 of user 2 is in the timeline of user 1
+    |     3      |    7      |      2      |   (post 7)  |  and in the timeline of user 3 (both follow user 2)
+    |____________|___________|_____________|_____________|
+"""
+
+
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # user whose timeline this is
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    # copied from the post, so unfollowing and reading never have to touch the posts table
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('owner_id', 'post_id', name='uq_timeline_owner_id_post_id'),
+        # reading a timeline page is a range scan on this index
+        db.Index('ix_timeline_owner_id_timestamp', 'owner_id', 'timestamp', 'post_id'),
+        db.Index('ix_timeline_post_id', 'post_id'),
+    )
+
+
 class Permission:
     FOLLOW = 1
     COMMENT = 2
@@ -417,12 +669,17 @@ class Comment(db.Model):
     body = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     disabled = db.Column(db.Boolean)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
 
+    # comments of a post, newest first (app/loaders.py)
+    __table_args__ = (
+        db.Index('ix_comments_post_id_timestamp', 'post_id', 'timestamp'),
+    )
+
     def comment_in_json(self):
 
-        the_user = User.query.get(self.author_id)
+        the_user = loaders.users().get(self.author_id)
         commented_by_user = the_user.less_user_info_json()
 
         json_response = {
@@ -437,12 +694,31 @@ class Comment(db.Model):
         return json_response
 
 
+# last like / unlike of a user on a post written by the like buffer, with the time it was made
+# (a worker flushing an older event does not undo a newer one of another worker, app/like_buffer.py)
+# rows older than LIKE_BUFFER_KEEP_ACTIONS_SECONDS are removed by the flushes.
+# no foreign keys, it is only bookkeeping of the buffer
+class LikeAction(db.Model):
+    __tablename__ = 'like_actions'
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    post_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    liked = db.Column(db.Boolean, nullable=False)
+    # (time.time() of the worker which got the request)
+    at = db.Column(db.Float, nullable=False, index=True)
+
+
 class PostLike(db.Model):
     __tablename__ = 'postlikes'
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), index=True)
+
+    # a user likes a post once (two quick likes used to add two rows)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='uq_postlikes_user_id_post_id'),
+    )
 
     def like_json(self):
 
@@ -450,7 +726,7 @@ class PostLike(db.Model):
             'id': self.id,
             'liked_by': self.user_id,
             'post_liked': self.post_id,
-            'liked_by_username': User.query.get(self.user_id).username
+            'liked_by_username': loaders.users().get(self.user_id).username
         }
 
         return json_response
@@ -1,10 +1,16 @@
 from flask import jsonify, request
 from flask_jwt_extended import current_user, jwt_required
 
+from app.decorators import read_only
 from app.postRoute.errors import bad_request, custom404
 
 from ..models import Message, User
 from .. import db
+from .. import inbox
+from .. import loaders
+from .. import search
+from .. import streaming
+from ..pagination import decode_rank_cursor, page_args
 from . import msgRoute
 
 
@@ -38,25 +44,29 @@ def send_message(id):
             shared_post_of_username=shared_post_of_username
         )
         db.session.add(new_msg)
+        inbox.message_sent(new_msg)
+        search.message_added(new_msg)
         db.session.commit()
         return jsonify({"msg": "message sent."}), 200
 
 
 @msgRoute.route('/sent_messages')
+@read_only
 @jwt_required()
 def sent_messages():
-    user_messages = [each_msg.msg_json()
-                     for each_msg in current_user.messages_sent.all()]
-    return jsonify({"sent_messages": user_messages}), 200
+    # (streamed, see app/streaming.py)
+    return streaming.stream_list(
+        "sent_messages", current_user.messages_sent, lambda each_msg: each_msg.msg_json(),
+        prime=loaders.prime_messages)
 
 
 @msgRoute.route('/received_messages')
+@read_only
 @jwt_required()
 def received_messages():
-    receieved_msgs = [each_msg.msg_json()
-                      for each_msg in current_user.messages_recieved.all()]
-    # print("receieved_msgs =>", receieved_msgs)
-    return jsonify({"received_messages": receieved_msgs})
+    return streaming.stream_list(
+        "received_messages", current_user.messages_recieved, lambda each_msg: each_msg.msg_json(),
+        prime=loaders.prime_messages)
 
 
 # delete message
@@ -67,29 +77,65 @@ def delete_message(id):
     if not msg:
         return jsonify({"error": "message not found"}), 404
 
+    inbox.message_deleted(msg)
+    search.message_removed(msg)
     db.session.delete(msg)
     db.session.commit()
     return jsonify({"message": "message deleted."}), 200
 
 
+# full-text search in the messages you sent or received (best match first), /search/messages?q=...
+@msgRoute.route('/search/messages')
+@read_only
+@jwt_required()
+def search_messages():
+    cursor, limit = page_args('MESSAGES_PER_PAGE', decode=decode_rank_cursor)
+    found_messages, next_cursor = search.messages(current_user, request.args.get('q'), cursor, limit)
+    return jsonify({
+        "messages": [each_msg.msg_json() for each_msg in loaders.prime_messages(found_messages)],
+        "next_cursor": next_cursor
+    })
+
+
 # id of the user with whom you chatted
+# returns the latest messages (oldest to newest), older ones with ?cursor=<next_cursor>
 @msgRoute.route('/show_conversation/<int:id>')
 @jwt_required()
 def show_conversation(id):
     # your_id = 3  # or current_user id, as we do not have a login system yet
-    current_user_obj = current_user
+    current_user_obj = current_user._get_current_object()
     other_person = User.query.get(id)
+    cursor, limit = page_args('MESSAGES_PER_PAGE')
 
-    # consider messages_recieved like a inbox of a user, and sent_by means message sent by some
-    # particular user (id in this case)
-    whole_conversation = current_user_obj.messages_recieved.filter_by(sent_by=id).all() + \
-        other_person.messages_recieved.filter_by(sent_by=current_user.id).all()
+    if not other_person:
+        return custom404("User not found.")
+
+    # latest messages are getting shown, so the ones you received are read now
+    if cursor is None and inbox.conversation_read(current_user_obj.id, id):
+        db.session.commit()
 
-    # sorting conversation, use reverse=True for descending order
-    # lambda method is like a shortcut to write functions in python (based on some condition)
-    whole_conversation.sort(key=lambda x: x.timestamp)
+    # messages sent by you to the other person and by the other person to you (newest first)
+    latest_messages, next_cursor = Message.conversation(current_user_obj.id, id, cursor, limit)
 
+    # both users are already loaded, so their names are not looked up again for every message
+    loaders.users().add([current_user_obj, other_person])
+
+    # page is shown in chat order (oldest message of the page first)
     conversation_array = [each_conv.msg_json()
-                          for each_conv in whole_conversation]
+                          for each_conv in reversed(latest_messages)]
+
+    return jsonify({"conversation": conversation_array, "next_cursor": next_cursor})
+
+# inbox (every user you chatted with, latest activity first)
+# with the last message of each conversation and how many messages you did not read yet
+@msgRoute.route('/inbox')
+@read_only
+@jwt_required()
+def inbox_summary():
+    cursor, limit = page_args('CONVERSATIONS_PER_PAGE')
+    conversations, next_cursor = inbox.read_page(current_user, cursor, limit)
+
+    inbox_array = [each_conv.inbox_json()
+                   for each_conv in loaders.prime_conversations(conversations)]
 
-    return jsonify({"conversation": conversation_array})
\ No newline at end of file
+    return jsonify({"inbox": inbox_array, "next_cursor": next_cursor})
\ No newline at end of file
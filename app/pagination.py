@@ -0,0 +1,106 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import or_
+
+# cursor (keyset) pagination
+# lists are ordered newest first by (timestamp, id) and a page is asked for with ?cursor=...&limit=...
+# the cursor holds the (timestamp, id) of the last row of the previous page, so the next page is a
+# simple "rows older than this one" range scan on the index instead of an OFFSET (which has to
+# walk over every skipped row and gets slower the deeper the page is).
+# for clients the cursor is an opaque string, they only need to send back the next_cursor they got.
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode(values):
+    raw = json.dumps(values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode(cursor):
+    try:
+        # adding back the '=' padding removed in _encode
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        return json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def encode_cursor(timestamp, id):
+    return _encode([timestamp.isoformat(), id])
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, id = _decode(cursor)
+        return datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+# cursor of a ranked list (search results) instead, holding the (rank, id) of the last row
+def encode_rank_cursor(rank, id):
+    return _encode([rank, id])
+
+
+def decode_rank_cursor(cursor):
+    try:
+        rank, id = _decode(cursor)
+        return float(rank), int(id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+# reads ?cursor= and ?limit= of the current request, limit falls back to the config page size
+# and can never go above MAX_PAGE_SIZE
+def page_args(size_key='POSTS_PER_PAGE', decode=decode_cursor):
+    limit = request.args.get('limit', type=int) or current_app.config[size_key]
+    limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+
+    cursor = request.args.get('cursor')
+    return (decode(cursor) if cursor else None), limit
+
+
+# the (timestamp, id) columns a list is ordered on, usually the ones of the model itself
+def cursor_keys(model):
+    return model.timestamp, model.id
+
+
+def after_cursor(query, keys, cursor):
+    timestamp_column, id_column = keys
+    timestamp, id = cursor
+    # same as "timestamp < t or (timestamp == t and id < i)", the extra "timestamp <= t" is
+    # what lets sqlite start the index scan at the cursor instead of at the newest row
+    return query.filter(
+        timestamp_column <= timestamp,
+        or_(timestamp_column < timestamp, id_column < id)
+    )
+
+
+def newest_first(keys):
+    return [each_key.desc() for each_key in keys]
+
+
+# rows should be fetched with limit + 1, the extra row only tells if there is another page
+def split_page(rows, limit):
+    if len(rows) > limit:
+        last_row = rows[limit - 1]
+        return rows[:limit], encode_cursor(last_row.timestamp, last_row.id)
+    return rows, None
+
+
+# newest limit + 1 rows older than the cursor
+def fetch_page(query, keys, cursor, limit):
+    if cursor is not None:
+        query = after_cursor(query, keys, cursor)
+    return query.order_by(*newest_first(keys)).limit(limit + 1).all()
+
+
+def paginate(query, model, cursor, limit, keys=None):
+    rows = fetch_page(query, keys or cursor_keys(model), cursor, limit)
+    return split_page(rows, limit)
@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# password hashing
+# hashing a password (register, login, password updates, account deletion) is slow on purpose, and
+# it used to run right inside the request thread, so a burst of logins kept every worker busy.
+# now the hashes are computed in a small pool of processes (PASSWORD_HASH_PROCESSES per worker)
+# and only PASSWORD_HASH_MAX_PENDING of them can be queued/running at once. a request which would
+# go over that limit is answered right away with a 503 (HashingBusy) instead of waiting, so the
+# requests which do not hash anything (reading posts etc.) always have threads left.
+#
+# the method and its cost come from the config (PASSWORD_HASH_METHOD, PASSWORD_HASH_ITERATIONS).
+# hashes stored with other settings keep working, and are replaced on the next successful login.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class HashingPool:
+
+    def __init__(self):
+        self.executor = None
+        self.slots = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.slots is None:
+                processes = current_app.config['PASSWORD_HASH_PROCESSES']
+                if processes > 0:
+                    # (started on first use, so every gunicorn worker gets its own processes)
+                    self.executor = ProcessPoolExecutor(max_workers=processes)
+                self.slots = threading.BoundedSemaphore(current_app.config['PASSWORD_HASH_MAX_PENDING'])
+
+    def run(self, func, *args):
+        if self.slots is None:
+            self._start()
+
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            # (without processes, hashing runs in the request thread, still limited by the slots)
+            if self.executor is None:
+                return func(*args)
+            return self.executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+
+pool = HashingPool()
+
+
+# "pbkdf2:sha256:600000", the format werkzeug takes and stores in front of the salt
+def _method():
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    iterations = current_app.config['PASSWORD_HASH_ITERATIONS']
+    if method.startswith('pbkdf2') and iterations:
+        return '%s:%d' % (method, iterations)
+    return method
+
+
+def hash_password(password):
+    return pool.run(generate_password_hash, password, _method(), current_app.config['PASSWORD_SALT_LENGTH'])
+
+
+def verify_password(password_hash, password):
+    if password_hash is None or password is None:
+        return False
+    return pool.run(check_password_hash, password_hash, password)
+
+
+# stored hash was made with other settings than the current ones
+def needs_rehash(password_hash):
+    return password_hash is not None and password_hash.split('$', 1)[0] != _method()
@@ -1,6 +1,8 @@
 
 from urllib import response
 from . import postRoute
+from ..pagination import InvalidCursor
+from ..passwords import HashingBusy
 from flask import request, jsonify
 
 # 404 error for pages
@@ -28,6 +30,16 @@ def page_not_found(e):
         response = jsonify({ "msg": 'Internal Server Error'})
         return response
 
+# cursor which was not created by us (or got modified)
+@postRoute.app_errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return bad_request("invalid cursor.")
+
+# too many passwords getting hashed right now (app/passwords.py)
+@postRoute.app_errorhandler(HashingBusy)
+def hashing_busy(e):
+    return service_unavailable("server is busy, try again in a moment.")
+
 # 403 forbidden
 def forbidden(message):
     response = jsonify({'error': 'forbidden', "msg": message})
@@ -44,4 +56,11 @@ def bad_request(message):
 def unauthorized(message):
     response = jsonify({ 'error': 'unauthorized', "msg": message })
     response.status_code = 401
+    return response
+
+# 503 service unavailable
+def service_unavailable(message):
+    response = jsonify({ 'error': 'service unavailable', "msg": message })
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
     return response
\ No newline at end of file
@@ -1,29 +1,47 @@
 
-from app.decorators import permission_required, verify_user_token
+from app.decorators import permission_required, read_only, verify_user_token
 from app.postRoute.errors import bad_request, forbidden, page_not_found, custom404
 from . import postRoute
 from ..models import Comment, Permission, Post, User
 from flask import jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity, current_user
+from .. import conditional
+from .. import counters
 from .. import db
+from .. import loaders
+from .. import search
+from .. import streaming
+from .. import timeline
+from .. import versions
+from ..pagination import decode_rank_cursor, page_args, paginate
 
 
-# get all posts
+# get all posts (newest first, paginated with ?cursor= and ?limit=)
 @postRoute.route('/posts')
+@read_only
 # @jwt_required()
 def get_posts():
-    posts = Post.query.all()
-    return jsonify({
-        'posts': [each_post.to_json() for each_post in posts]        
-    })
+    cursor, limit = page_args()
+    posts, next_cursor = paginate(Post.query, Post, cursor, limit)
+    # (a page is at most MAX_PAGE_SIZE posts anyway, written like the streamed lists so it can be
+    # read as ndjson too, see app/streaming.py)
+    return streaming.stream_list(
+        'posts', posts, lambda each_post: each_post.to_json(),
+        prime=loaders.prime_posts, extra={'next_cursor': next_cursor})
 
 # get a particular post
 @postRoute.route('/posts/<int:id>')
+@read_only
 def get_post(id):
-    post = Post.query.get(id)
-    if not post:
+    # (304 without loading the post when the client has the current version)
+    marker = versions.post_marker(id)
+    if marker is None:
         return custom404("post not found")
-    return jsonify(post.to_json())
+    if conditional.is_fresh(*marker):
+        return conditional.not_modified(*marker)
+
+    post = Post.query.get(id)
+    return conditional.with_validators(jsonify(post.to_json()), *marker)
 
 
 # create post
@@ -37,6 +55,10 @@ def create_post():
 
     new_post = Post(uploaded_content_url=content_url, body=body, author=current_user) # where author is the backref
     db.session.add(new_post)
+    counters.add(current_user, 'post_count')
+    # adding the post to the timeline of every follower (in the same transaction)
+    timeline.fan_out_post(new_post)
+    search.post_added(new_post)
     db.session.commit()
     return jsonify({"msg": "Post Created."}), 201
 
@@ -59,8 +81,11 @@ def edit_post(id):
         return forbidden("Operation not allowed!")
     
     else:
+        old_body = post_to_edit.body
         post_to_edit.uploaded_content_url = post_to_edit.uploaded_content_url if content_url is None else content_url
         post_to_edit.body = post_to_edit.body if body is None else body
+        search.post_changed(post_to_edit, old_body)
+        versions.touch(post_to_edit)
         db.session.add(post_to_edit)
         db.session.commit()
 
@@ -81,27 +106,42 @@ def delete_post(id):
         return forbidden("Operation not allowed!")
     
     else:
+        timeline.remove_post(post_to_delete)
+        search.post_removed(post_to_delete)
+        counters.add(current_user, 'post_count', -1)
         db.session.delete(post_to_delete)
         db.session.commit()
         return jsonify({"msg": "Post Deleted."}), 204
         
 
-# posts of the followed users
+# posts of the followed users (newest first, paginated with ?cursor= and ?limit=)
 @postRoute.route('/followed_users_posts')
+@read_only
 @jwt_required()
 def followed_posts():
-    following_users = current_user.following_to_list.all()
-    followed_posts = []
+    cursor, limit = page_args()
     result = []
 
-    for each_user in following_users:
-        locate_user = User.query.get(each_user.following_to)
-        followed_posts += locate_user.posts
+    # read from the materialized timeline of the user (see app/timeline.py)
+    followed_posts, next_cursor = timeline.read_page(current_user, cursor, limit)
 
-    for each_post in followed_posts:
+    for each_post in loaders.prime_posts(followed_posts):
         result.append(each_post.to_json())
     
-    return jsonify({"followed_posts": result})
+    return jsonify({"followed_posts": result, "next_cursor": next_cursor})
+
+
+# full-text search of posts (best match first), /search/posts?q=...
+@postRoute.route('/search/posts')
+@read_only
+@jwt_required()
+def search_posts():
+    cursor, limit = page_args(decode=decode_rank_cursor)
+    found_posts, next_cursor = search.posts(request.args.get('q'), cursor, limit)
+    return jsonify({
+        "posts": [each_post.to_json() for each_post in loaders.prime_posts(found_posts)],
+        "next_cursor": next_cursor
+    })
 
 
 # make comment
@@ -119,6 +159,7 @@ def make_comment(id):
     elif current_user.is_following(post_author) or current_user.id == post_author.id:        
         new_comm = Comment(body=comm_body, author_backref=current_user, post_backref=post_to_comment_in)
         db.session.add(new_comm)
+        counters.add(post_to_comment_in, 'comment_count')
         db.session.commit()    
         return jsonify({"msg": "comment added."})
     else:
@@ -138,6 +179,8 @@ def delete_comment(id):
 
     # needs to be the same author/user who made the comment else an admin or moderator
     elif current_user.id == comm_to_delete.author_id or admin_privileges or moderator_privileges:       
+        if comm_to_delete.post_backref:
+            counters.add(comm_to_delete.post_backref, 'comment_count', -1)
         db.session.delete(comm_to_delete)
         db.session.commit()
         return jsonify({"msg": "Comment Deleted."}), 204
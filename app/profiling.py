@@ -0,0 +1,113 @@
+import cProfile
+import itertools
+import os
+import random
+import time
+from flask import current_app, g, request
+from flask_jwt_extended import get_current_user, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+
+# profiling live requests (PROFILING_ENABLED, off by default)
+# a request runs under cProfile when an admin sends the PROFILING_HEADER header (X-Profile: 1),
+# or for one in PROFILING_SAMPLE_RATE requests (0 for none). the profile is written to
+# PROFILING_DIR as a pstats file, named after the time and the endpoint, and the name comes back
+# in the X-Profile response header. only the newest PROFILING_MAX_FILES files are kept.
+# admins list them on GET /profiles and download them from GET /profiles/<name>, then
+#   python -m pstats <name>.prof   (or snakeviz, flameprof ...)
+#
+# with PROFILING_ENABLED off nothing is registered, requests do not pay anything for it.
+# streamed bodies (app/streaming.py) are part of the profile, it ends when the request is done.
+
+SUFFIX = '.prof'
+
+_sequence = itertools.count()
+
+
+def _is_admin():
+    from .models import Permission
+
+    try:
+        verify_jwt_in_request(optional=True)
+        user = get_current_user()
+    except (RuntimeError, JWTExtendedException, PyJWTError):
+        return False
+    return user is not None and user.check_permission_exists_in_user(Permission.ADMIN)
+
+
+def _wanted(app):
+    if request.headers.get(app.config['PROFILING_HEADER']) and _is_admin():
+        return True
+    rate = app.config['PROFILING_SAMPLE_RATE']
+    return rate > 0 and random.randrange(rate) == 0
+
+
+def _name():
+    return '%s-%s-%d-%d' % (time.strftime('%Y%m%dT%H%M%S'), request.endpoint or 'none', os.getpid(), next(_sequence))
+
+
+# newest first, [{name, size, created}, ...]
+def list_profiles(directory):
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for each_name in os.listdir(directory):
+        if not each_name.endswith(SUFFIX):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, each_name))
+        except FileNotFoundError:
+            continue
+        profiles.append({'name': each_name, 'size': stat.st_size, 'created': stat.st_mtime})
+    profiles.sort(key=lambda each_profile: each_profile['created'], reverse=True)
+    return profiles
+
+
+# removes all but the newest `keep` profiles
+def _trim(directory, keep):
+    for each_profile in list_profiles(directory)[keep:]:
+        try:
+            os.remove(os.path.join(directory, each_profile['name']))
+        except FileNotFoundError:
+            # (another worker removed it)
+            pass
+
+
+def _write(profiler, name):
+    directory = current_app.config['PROFILING_DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + SUFFIX)
+    # (listed only once it is complete)
+    profiler.dump_stats(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    _trim(directory, current_app.config['PROFILING_MAX_FILES'])
+
+
+def init_app(app):
+    if not app.config['PROFILING_ENABLED']:
+        return
+
+    @app.before_request
+    def start_profile():
+        if not _wanted(app):
+            return
+        g.profile_name = _name()
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    @app.after_request
+    def add_profile_header(response):
+        if g.get('profiler') is not None:
+            response.headers['X-Profile'] = g.profile_name + SUFFIX
+        return response
+
+    @app.teardown_request
+    def write_profile(exception):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        profiler.disable()
+        try:
+            _write(profiler, g.profile_name)
+        except OSError:
+            app.logger.exception('writing the profile %s failed', g.profile_name)
@@ -0,0 +1,37 @@
+from sqlalchemy import text
+
+# sqlite query plans of the hot queries, see `flask query-plans`
+# "SEARCH ... USING INDEX" is what they should show, "SCAN <table>" reads the whole table and
+# "USE TEMP B-TREE" sorts the rows. the plans before and after the indexes of
+# migrations/versions/3b9f1c7d2e4a_hot_path_indexes.py are written down in that migration.
+
+HOT_QUERIES = [
+    # (what / where, query)
+    ('like of a user on a post (like_or_unlike)',
+     "SELECT id FROM postlikes WHERE user_id = 1 AND post_id = 1"),
+    ('likes of a page of posts (app/loaders.py)',
+     "SELECT * FROM postlikes WHERE post_id IN (1, 2, 3) ORDER BY id"),
+    ('recent likes of a user (app/suggestions.py)',
+     "SELECT post_id FROM postlikes WHERE user_id = 1 ORDER BY id DESC LIMIT 100"),
+    ('comments of a page of posts (app/loaders.py)',
+     "SELECT * FROM comments WHERE post_id IN (1, 2, 3) ORDER BY timestamp DESC, id DESC"),
+    ('posts a user commented on (app/versions.py)',
+     "SELECT post_id FROM comments WHERE author_id = 1"),
+    ('posts of a user (profile page)',
+     "SELECT * FROM posts WHERE author_id = 1 ORDER BY timestamp DESC, id DESC LIMIT 21"),
+    ('sent messages',
+     "SELECT * FROM messages WHERE sent_by = 1"),
+    ('received messages',
+     "SELECT * FROM messages WHERE sent_for = 1"),
+    ('followers of a user (fan out, counters, app/versions.py)',
+     "SELECT follower_id FROM follows WHERE following_to = 1"),
+]
+
+
+# [(name, [plan lines]), ...]
+def explain(connection):
+    plans = []
+    for each_name, each_query in HOT_QUERIES:
+        rows = connection.execute(text('EXPLAIN QUERY PLAN ' + each_query)).all()
+        plans.append((each_name, [each_row[-1] for each_row in rows]))
+    return plans
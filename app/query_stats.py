@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import Counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# sql queries per request (QUERY_STATS_ENABLED)
+# every statement run while a request is handled is counted and timed (engine events), so it
+# shows how many queries an endpoint really runs and how long they take:
+# - X-DB-Query-Count, X-DB-Time-Ms and X-DB-Slowest-Ms response headers (QUERY_STATS_HEADERS)
+# - a log line per request, with the slowest statement
+# - a warning when the same statement runs more than QUERY_STATS_REPEAT_THRESHOLD times in one
+#   request (N+1: a query per row instead of one for all of them, see app/loaders.py)
+# - totals per blueprint (postRoute, userRoute ...) of this worker, see by_blueprint()
+#
+# headers only count the queries run before the response is returned, the log line is written
+# once the request is done, so it also has the ones of streamed bodies (app/streaming.py).
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        if seconds >= self.slowest:
+            self.slowest = seconds
+            self.slowest_statement = statement
+
+
+class BlueprintTotals:
+
+    def __init__(self):
+        self.totals = {}  # blueprint => [requests, queries, seconds, slowest, slowest statement]
+        self.lock = threading.Lock()
+
+    def add(self, blueprint, stats):
+        with self.lock:
+            totals = self.totals.setdefault(blueprint, [0, 0, 0.0, 0.0, None])
+            totals[0] += 1
+            totals[1] += stats.count
+            totals[2] += stats.seconds
+            if stats.slowest >= totals[3]:
+                totals[3] = stats.slowest
+                totals[4] = stats.slowest_statement
+
+
+blueprint_totals = BlueprintTotals()
+
+
+# {blueprint: {requests, queries, db_seconds, slowest_seconds, slowest_statement}} of this worker
+def by_blueprint():
+    with blueprint_totals.lock:
+        return {
+            each_blueprint: {
+                'requests': each_totals[0],
+                'queries': each_totals[1],
+                'db_seconds': each_totals[2],
+                'slowest_seconds': each_totals[3],
+                'slowest_statement': each_totals[4]
+            }
+            for each_blueprint, each_totals in blueprint_totals.totals.items()
+        }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    if has_request_context():
+        stats = g.get('query_stats')
+        if stats is not None:
+            stats.add(statement, time.perf_counter() - started)
+
+
+# (no after_cursor_execute for a failed statement)
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+# (start and end of long statements, the end has the FROM / WHERE part)
+def _shorten(statement, length=100):
+    statement = ' '.join(statement.split())
+    if len(statement) <= 2 * length:
+        return statement
+    return statement[:length] + ' ... ' + statement[-length:]
+
+
+def _start_request():
+    g.query_stats = RequestStats()
+
+
+# counting and timing the queries of every request in g.query_stats (also used by app/metrics.py)
+def collect(app):
+    if app.extensions.get('query_stats'):
+        return
+    app.extensions['query_stats'] = True
+
+    # (every engine, the read-only one of app/database.py too)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    app.before_request(_start_request)
+
+
+def init_app(app):
+    if not app.config['QUERY_STATS_ENABLED']:
+        return
+
+    collect(app)
+
+    @app.after_request
+    def add_headers(response):
+        stats = g.get('query_stats')
+        if stats is not None and app.config['QUERY_STATS_HEADERS']:
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+            response.headers['X-DB-Time-Ms'] = '%.2f' % (stats.seconds * 1000)
+            response.headers['X-DB-Slowest-Ms'] = '%.2f' % (stats.slowest * 1000)
+        return response
+
+    @app.teardown_request
+    def log_stats(exception):
+        stats = g.get('query_stats')
+        if stats is None:
+            return
+
+        blueprint = request.blueprint or 'app'
+        blueprint_totals.add(blueprint, stats)
+        app.logger.info(
+            '%s %s (%s) queries=%d db=%.2fms slowest=%.2fms %s',
+            request.method, request.path, request.endpoint, stats.count, stats.seconds * 1000,
+            stats.slowest * 1000, _shorten(stats.slowest_statement or ''))
+
+        threshold = app.config['QUERY_STATS_REPEAT_THRESHOLD']
+        for each_statement, each_count in stats.statements.items():
+            if each_count > threshold:
+                app.logger.warning(
+                    'N+1 in %s %s (%s): statement ran %d times: %s',
+                    request.method, request.path, request.endpoint, each_count, _shorten(each_statement))
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+from . import db
+
+# roles kept in memory
+# there are only a few roles (see Role.insert_roles) and they almost never change, but their name
+# and permissions were read from the roles table for every serialized user, every permission
+# check and every registration. now every worker process loads the whole table once (at
+# create_app) and everything reads it from here.
+#
+# the registry is loaded again after a commit which added, changed or deleted a role. other
+# gunicorn workers do not see that commit, they load it again after ROLE_REGISTRY_TTL seconds.
+
+
+class RoleInfo(namedtuple('RoleInfo', ['id', 'name', 'default', 'permissions'])):
+
+    # (same as Role.has_permission)
+    def has_permission(self, perm):
+        return self.permissions & perm == perm
+
+
+class RoleRegistry:
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        self.default = None
+        self.expires_at = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        from .models import Role
+
+        rows = db.session.query(Role.id, Role.name, Role.default, Role.permissions).all()
+        all_roles = [RoleInfo(*each_row) for each_row in rows]
+
+        with self.lock:
+            self.by_id = {each_role.id: each_role for each_role in all_roles}
+            self.by_name = {each_role.name: each_role for each_role in all_roles}
+            self.default = next((each_role for each_role in all_roles if each_role.default), None)
+            self.expires_at = time.monotonic() + current_app.config['ROLE_REGISTRY_TTL']
+
+    def expire(self):
+        self.expires_at = 0
+
+    def _fresh(self):
+        if time.monotonic() >= self.expires_at:
+            self.load()
+        return self
+
+    def get(self, role_id):
+        return self._fresh().by_id.get(role_id)
+
+    def named(self, name):
+        return self._fresh().by_name.get(name)
+
+    def default_role(self):
+        return self._fresh().default
+
+
+registry = RoleRegistry()
+
+
+def get(role_id):
+    return registry.get(role_id)
+
+
+def named(name):
+    return registry.named(name)
+
+
+def default_role():
+    return registry.default_role()
+
+
+def role_name(role_id):
+    role = registry.get(role_id)
+    return role.name if role is not None else ""
+
+
+# called by create_app, a new database has no tables yet (flask db upgrade runs create_app too),
+# then the roles are loaded on first use instead
+def init_app(app):
+    with app.app_context():
+        try:
+            registry.load()
+        except (OperationalError, ProgrammingError):
+            registry.expire()
+        finally:
+            db.session.remove()
+
+
+# reloading after a committed role change
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    from .models import Role
+
+    changed_roles = [each_obj for each_obj in session.dirty
+                     if isinstance(each_obj, Role) and session.is_modified(each_obj)]
+    added_or_deleted = [each_obj for each_obj in list(session.new) + list(session.deleted)
+                        if isinstance(each_obj, Role)]
+    if changed_roles or added_or_deleted:
+        session.info['roles_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _reload(session):
+    if session.info.pop('roles_changed', False):
+        registry.expire()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('roles_changed', None)
@@ -0,0 +1,214 @@
+import re
+from sqlalchemy import event, text
+from . import db
+from . import pagination
+
+# full-text search (sqlite FTS5)
+# posts_fts, users_fts and messages_fts index Post.body, User.username and Message.body. they are
+# "external content" tables, so the text itself is not stored twice, only the index. sqlite does
+# not keep such an index up to date on its own, the write paths do it instead (in the same
+# transaction, like app/timeline.py): create/edit/delete post, register, update_username, user
+# deletion, send/delete message. removing a row from the index needs the text it was indexed
+# with, so edits pass the old value. users are removed with the username stored in the table, the
+# logged in user can come from the cache of app/user_cache.py, with a name another worker changed.
+#
+# the tables are created together with the others (db.create_all) and, for databases made with
+# migrations, when the app starts, then they are filled from the rows already there (an empty index
+# over existing rows would fail the first 'delete' of one of them). `flask rebuild-search` fills
+# them again.
+#
+# results are ranked with bm25 (best match first) and paginated with a cursor of (rank, id). ranks
+# depend on the whole index, so rows added between two pages can move results a little.
+
+INDEXES = {
+    # name: (content table, indexed column)
+    'posts_fts': ('posts', 'body'),
+    'users_fts': ('users', 'username'),
+    'messages_fts': ('messages', 'body'),
+}
+
+
+def _tables(connection):
+    return {each_row[0] for each_row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+
+
+# returns the names of the indexes which were not there yet
+def _create_tables(connection):
+    existing = _tables(connection)
+    for each_name, (each_table, each_column) in INDEXES.items():
+        # (prefix indexes make "word*" queries, used for the last word typed, cheap)
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, content='%s', content_rowid='id', prefix='2 3')"
+            % (each_name, each_column, each_table)))
+    return [each_name for each_name in INDEXES if each_name not in existing]
+
+
+def _rebuild(connection, name):
+    connection.execute(text("INSERT INTO %s(%s) VALUES ('rebuild')" % (name, name)))
+
+
+def _drop_tables(connection):
+    for each_name in INDEXES:
+        connection.execute(text("DROP TABLE IF EXISTS %s" % each_name))
+
+
+@event.listens_for(db.Model.metadata, 'after_create')
+def _after_create(target, connection, **kw):
+    _create_tables(connection)
+
+
+@event.listens_for(db.Model.metadata, 'before_drop')
+def _before_drop(target, connection, **kw):
+    _drop_tables(connection)
+
+
+def init_app(app):
+    with app.app_context():
+        with db.engine.begin() as connection:
+            created = _create_tables(connection)
+            # (a database made with migrations, its rows were never indexed)
+            content_tables = _tables(connection)
+            for each_name in created:
+                if INDEXES[each_name][0] in content_tables:
+                    _rebuild(connection, each_name)
+
+
+def _index(name, id, value):
+    column = INDEXES[name][1]
+    db.session.execute(
+        text("INSERT INTO %s(rowid, %s) VALUES (:id, :value)" % (name, column)),
+        {'id': id, 'value': value})
+
+
+def _unindex(name, id, value):
+    column = INDEXES[name][1]
+    db.session.execute(
+        text("INSERT INTO %s(%s, rowid, %s) VALUES ('delete', :id, :value)" % (name, name, column)),
+        {'id': id, 'value': value})
+
+
+# un-indexing rows with the text stored in the content table (before it changes)
+def _unindex_stored(name, where, **params):
+    content_table, column = INDEXES[name]
+    db.session.execute(
+        text("INSERT INTO %s(%s, rowid, %s) SELECT 'delete', id, %s FROM %s WHERE %s"
+             % (name, name, column, column, content_table, where)),
+        params)
+
+
+# write paths (the caller commits)
+
+def post_added(post):
+    # post id is only there after a flush
+    db.session.flush()
+    _index('posts_fts', post.id, post.body)
+
+
+def post_changed(post, old_body):
+    if old_body != post.body:
+        _unindex('posts_fts', post.id, old_body)
+        _index('posts_fts', post.id, post.body)
+
+
+def post_removed(post):
+    _unindex('posts_fts', post.id, post.body)
+
+
+def user_added(user):
+    db.session.flush()
+    _index('users_fts', user.id, user.username)
+
+
+# before user.username is changed
+def rename_user(user, new_username):
+    _unindex_stored('users_fts', "id = :user_id", user_id=user.id)
+    _index('users_fts', user.id, new_username)
+
+
+# user is getting deleted, with their posts
+def remove_user(user):
+    _unindex_stored('posts_fts', "author_id = :user_id", user_id=user.id)
+    _unindex_stored('users_fts', "id = :user_id", user_id=user.id)
+
+
+def message_added(message):
+    db.session.flush()
+    _index('messages_fts', message.id, message.body)
+
+
+def message_removed(message):
+    _unindex('messages_fts', message.id, message.body)
+
+
+# refilling every index from its content table
+def rebuild_all():
+    with db.engine.begin() as connection:
+        _create_tables(connection)
+        for each_name in INDEXES:
+            _rebuild(connection, each_name)
+
+
+# searching
+
+# what the user typed, as a query every word has to match (the last one as a prefix, for search as
+# you type). FTS5 syntax (quotes, operators ...) is not passed through, returns None without words
+def match_query(typed):
+    words = re.findall(r'\w+', typed or '')
+    if not words:
+        return None
+    quoted = ['"%s"' % each_word for each_word in words]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+# a page of (id, rank) of the best matches, returns (ids, next_cursor)
+# `only` is an extra sql condition on the content table (aliased as c), with its parameters
+def _search(name, typed, cursor, limit, only=None, **params):
+    match = match_query(typed)
+    if match is None:
+        return [], None
+
+    content_table = INDEXES[name][0]
+    conditions = ["%s MATCH :match" % name]
+    if cursor is not None:
+        # (same order as below, rank first, newest first for equal ranks)
+        conditions.append("(rank > :rank OR (rank = :rank AND %s.rowid < :last_id))" % name)
+        params['rank'], params['last_id'] = cursor
+    if only is not None:
+        conditions.append(only)
+
+    statement = "SELECT %s.rowid, rank FROM %s JOIN %s AS c ON c.id = %s.rowid WHERE %s " \
+                "ORDER BY rank, %s.rowid DESC LIMIT :limit" \
+                % (name, name, content_table, name, ' AND '.join(conditions), name)
+    rows = db.session.execute(text(statement), dict(params, match=match, limit=limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.encode_rank_cursor(rows[-1][1], rows[-1][0])
+    return [each_row[0] for each_row in rows], next_cursor
+
+
+def _in_order(model, ids):
+    found = {each_obj.id: each_obj for each_obj in model.query.filter(model.id.in_(ids)).all()} if ids else {}
+    return [found[each_id] for each_id in ids if each_id in found]
+
+
+def posts(typed, cursor, limit):
+    from .models import Post
+    ids, next_cursor = _search('posts_fts', typed, cursor, limit)
+    return _in_order(Post, ids), next_cursor
+
+
+def users(typed, cursor, limit):
+    from .models import User
+    ids, next_cursor = _search('users_fts', typed, cursor, limit)
+    return _in_order(User, ids), next_cursor
+
+
+# only the messages user sent or received
+def messages(user, typed, cursor, limit):
+    from .models import Message
+    ids, next_cursor = _search('messages_fts', typed, cursor, limit,
+                               only="(c.sent_by = :user_id OR c.sent_for = :user_id)", user_id=user.id)
+    return _in_order(Message, ids), next_cursor
@@ -0,0 +1,74 @@
+from flask import current_app, request, stream_with_context
+from . import loaders
+
+# streamed list responses
+# lists which can be as big as a whole table (every user, every message of a user) are not built
+# in memory and then jsonified anymore. rows are read STREAM_CHUNK_SIZE at a time (yield_per),
+# every chunk is primed (app/loaders.py), serialized and written out, then forgotten (the loaders
+# are reset after every chunk), so a worker only ever holds one chunk, however long the list is.
+#
+# the body is the same json object as before ({"users": [...]}), written piece by piece, or with
+# "Accept: application/x-ndjson" one json object per line (extra values, like next_cursor, are
+# sent as X-... headers then).
+
+NDJSON = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+# rows of query (or of a plain list) in lists of up to size rows
+def _chunks(rows, size):
+    if hasattr(rows, 'yield_per'):
+        rows = rows.yield_per(size)
+
+    chunk = []
+    for each_row in rows:
+        chunk.append(each_row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# key: name of the list in the json object, rows: query (or list) of the rows,
+# to_json: serializes one row, prime: called with every chunk before serializing it,
+# extra: other values of the json object (example next_cursor)
+def stream_list(key, rows, to_json, prime=None, extra=None):
+    size = current_app.config['STREAM_CHUNK_SIZE']
+    # (compact, like jsonify outside of debug mode)
+    dumps = lambda obj: current_app.json.dumps(obj, separators=(',', ':'))
+    ndjson = wants_ndjson()
+
+    def serialized_chunks():
+        for each_chunk in _chunks(rows, size):
+            if prime is not None:
+                prime(each_chunk)
+            yield [dumps(to_json(each_row)) for each_row in each_chunk]
+            loaders.reset()
+
+    def ndjson_body():
+        for each_chunk in serialized_chunks():
+            yield ''.join(each_item + '\n' for each_item in each_chunk)
+
+    def json_body():
+        yield '{%s: [' % dumps(key)
+        first = True
+        for each_chunk in serialized_chunks():
+            yield ('' if first else ',') + ','.join(each_chunk)
+            first = False
+        yield ']'
+        for each_key, each_value in (extra or {}).items():
+            yield ', %s: %s' % (dumps(each_key), dumps(each_value))
+        yield '}\n'
+
+    if ndjson:
+        response = current_app.response_class(stream_with_context(ndjson_body()), mimetype=NDJSON)
+        for each_key, each_value in (extra or {}).items():
+            if each_value is not None:
+                response.headers['X-' + each_key.replace('_', '-').title()] = str(each_value)
+        return response
+
+    return current_app.response_class(stream_with_context(json_body()), mimetype='application/json')
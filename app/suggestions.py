@@ -0,0 +1,124 @@
+import random
+from collections import Counter
+from flask import current_app
+from sqlalchemy import func, select
+from . import db
+from . import follow_graph
+from . import loaders
+from .user_cache import LRUCache
+
+# "suggested users"
+# users someone does not follow yet, ranked by
+# - shared connections: how many of the users they follow follow the candidate (friend of friend,
+#   read from the in-memory follow graph)
+# - shared engagement: how many of the posts they liked lately the candidate liked as well, and
+#   how many posts of the candidate they liked
+# people with neither (new users) get the most followed users.
+#
+# the ranking of a user is computed once and kept per worker for SUGGESTIONS_TTL seconds (up to
+# SUGGESTIONS_CACHE_SIZE users). until then only follow changes are applied to it (followed users
+# drop out when the list is read), so reading suggestions is a cache lookup most of the time.
+#
+# to keep the work bounded for users with huge neighbourhoods only up to SUGGESTIONS_MAX_FOLLOWED
+# followed users (picked at random) are walked, each with up to SUGGESTIONS_MAX_NEIGHBOURS of the
+# users they follow, and only the last SUGGESTIONS_RECENT_LIKES likes are used.
+
+SHARED_CONNECTION_WEIGHT = 3
+SHARED_LIKE_WEIGHT = 1
+LIKED_AUTHOR_WEIGHT = 2
+# how many ranked candidates are kept per user
+RANKING_SIZE = 200
+
+rankings = LRUCache()
+popular = LRUCache()
+
+
+def _some_of(ids, limit):
+    return ids if len(ids) <= limit else random.sample(ids, limit)
+
+
+def _shared_connections(followed_ids):
+    shared = Counter()
+    for each_id in _some_of(followed_ids, current_app.config['SUGGESTIONS_MAX_FOLLOWED']):
+        neighbours = follow_graph.following_of(each_id)
+        shared.update(_some_of(neighbours, current_app.config['SUGGESTIONS_MAX_NEIGHBOURS']))
+    return shared
+
+
+# (users who liked the same posts, authors of the liked posts)
+def _shared_likes(user_id):
+    from .models import Post, PostLike
+
+    recent_likes = select(PostLike.post_id).where(PostLike.user_id == user_id) \
+        .order_by(PostLike.id.desc()).limit(current_app.config['SUGGESTIONS_RECENT_LIKES'])
+    recent_likes = [each_row[0] for each_row in db.session.execute(recent_likes)]
+    if not recent_likes:
+        return Counter(), Counter()
+
+    co_likers = db.session.query(PostLike.user_id, func.count()) \
+        .filter(PostLike.post_id.in_(recent_likes), PostLike.user_id != user_id) \
+        .group_by(PostLike.user_id).order_by(func.count().desc()).limit(RANKING_SIZE).all()
+
+    liked_authors = db.session.query(Post.author_id, func.count()) \
+        .filter(Post.id.in_(recent_likes)) \
+        .group_by(Post.author_id).all()
+
+    return Counter(dict(co_likers)), Counter(dict(liked_authors))
+
+
+def _most_followed():
+    from .models import User
+
+    most_followed = popular.get('users')
+    if most_followed is None:
+        most_followed = [each_row[0] for each_row in db.session.query(User.id)
+                         .order_by(User.follower_count.desc(), User.id).limit(RANKING_SIZE)]
+        popular.put('users', most_followed, current_app.config['SUGGESTIONS_TTL'], 1)
+    return most_followed
+
+
+# ranking of every candidate for user_id, [(user_id, shared connections, shared engagement), ...]
+def _rank(user_id):
+    followed_ids = follow_graph.following_of(user_id)
+    shared = _shared_connections(followed_ids)
+    co_likes, liked_authors = _shared_likes(user_id)
+
+    candidates = set(shared) | set(co_likes) | set(liked_authors)
+    candidates.discard(user_id)
+    candidates.difference_update(followed_ids)
+
+    def score(candidate):
+        return (SHARED_CONNECTION_WEIGHT * shared[candidate]
+                + SHARED_LIKE_WEIGHT * co_likes[candidate]
+                + LIKED_AUTHOR_WEIGHT * liked_authors[candidate])
+
+    ranked = sorted(candidates, key=lambda candidate: (-score(candidate), candidate))[:RANKING_SIZE]
+    ranking = [(each_id, shared[each_id], co_likes[each_id] + liked_authors[each_id]) for each_id in ranked]
+
+    # filling up with the most followed users (nothing in common with them)
+    if len(ranking) < RANKING_SIZE:
+        ranked = set(ranked)
+        for each_id in _most_followed():
+            if each_id != user_id and each_id not in ranked and not follow_graph.is_following(user_id, each_id):
+                ranking.append((each_id, 0, 0))
+
+    return ranking[:RANKING_SIZE]
+
+
+# up to `limit` suggestions for user, [(User, shared connections, shared engagement), ...]
+def suggest(user, limit):
+    ranking = rankings.get(user.id)
+    if ranking is None:
+        ranking = _rank(user.id)
+        rankings.put(user.id, ranking,
+                     current_app.config['SUGGESTIONS_TTL'], current_app.config['SUGGESTIONS_CACHE_SIZE'])
+
+    # (users followed since the ranking was computed are skipped)
+    ranking = [each_entry for each_entry in ranking if not follow_graph.is_following(user.id, each_entry[0])]
+
+    # a few more than needed, some of them may have been deleted since
+    ranking = ranking[:limit + 10]
+    found_users = {each_user.id: each_user for each_user in loaders.prime_users([each_entry[0] for each_entry in ranking])}
+    suggestions = [(found_users[each_id], shared, shared_engagement)
+                   for each_id, shared, shared_engagement in ranking if each_id in found_users]
+    return suggestions[:limit]
@@ -0,0 +1,185 @@
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select
+from . import db
+from . import pagination
+
+# materialized home timeline (fan-out on write)
+# when a post gets created it is copied (post id, author, timestamp) into the timeline of every
+# follower of the author, and following/unfollowing someone adds/removes their posts in the
+# timeline of the follower. reading the followed users posts is then a single range scan on
+# ix_timeline_owner_id_timestamp, no matter how many users someone follows.
+#
+# every timeline keeps about TIMELINE_MAX_ENTRIES posts (older ones are trimmed, see _trim), and
+# authors with more than TIMELINE_FANOUT_LIMIT followers are not copied at all (that would be one
+# row per follower for every post), their posts are merged in at read time (fan-out on read).
+#
+# all functions only add statements to the current session, the caller commits them together
+# with the change which caused them (new post, follow etc.)
+# (timeline rows are never loaded as objects, so the session has nothing to synchronize)
+NO_SYNC = {'synchronize_session': False}
+
+
+def _timeline_keys():
+    from .models import TimelineEntry
+    return TimelineEntry.timestamp, TimelineEntry.post_id
+
+
+# deleting the oldest entries of the given timelines, so every one of them keeps the
+# newest TIMELINE_MAX_ENTRIES posts
+def _trim(owner_ids):
+    from .models import TimelineEntry
+
+    rank = func.row_number().over(
+        partition_by=TimelineEntry.owner_id,
+        order_by=pagination.newest_first(_timeline_keys())
+    ).label('rank')
+    ranked = select(TimelineEntry.id, rank).where(TimelineEntry.owner_id.in_(owner_ids)).subquery()
+    overflow = select(ranked.c.id).where(ranked.c.rank > current_app.config['TIMELINE_MAX_ENTRIES'])
+
+    db.session.execute(
+        delete(TimelineEntry).where(TimelineEntry.id.in_(overflow)).execution_options(**NO_SYNC))
+
+
+# new post, copying it into the timeline of every follower of its author
+def fan_out_post(post):
+    from .models import Follow, TimelineEntry
+
+    author = post.author
+    if author.fan_out_on_read:
+        return
+
+    # post id and timestamp are only there after a flush
+    db.session.flush()
+
+    followers = select(
+        Follow.follower_id,
+        literal(post.id),
+        literal(post.author_id),
+        literal(post.timestamp, db.DateTime)
+    ).where(Follow.following_to == post.author_id)
+
+    copied = db.session.execute(
+        insert(TimelineEntry).prefix_with('OR IGNORE').from_select(
+            ['owner_id', 'post_id', 'author_id', 'timestamp'], followers)
+    ).rowcount
+
+    # author got too many followers, their next posts will be read from the posts table
+    if copied > current_app.config['TIMELINE_FANOUT_LIMIT']:
+        author.fan_out_on_read = True
+        db.session.add(author)
+
+    # trimming every timeline on every post would read all the entries of every follower, so only
+    # about one in TIMELINE_TRIM_EVERY of them (picked at random) is trimmed per post, a timeline
+    # can therefore go a little over TIMELINE_MAX_ENTRIES before it gets trimmed again
+    trim_every = current_app.config['TIMELINE_TRIM_EVERY']
+    some_followers = select(Follow.follower_id).where(
+        Follow.following_to == post.author_id,
+        func.abs(func.random()) % trim_every == 0
+    )
+    _trim(some_followers)
+
+
+def remove_post(post):
+    from .models import TimelineEntry
+    db.session.execute(
+        delete(TimelineEntry).where(TimelineEntry.post_id == post.id).execution_options(**NO_SYNC))
+
+
+# follower started following author, adding the newest posts of author to the follower timeline
+def add_author(follower, author):
+    add_authors(follower, [author])
+
+
+# (batch follow, the timeline gets trimmed once after all the authors were added)
+def add_authors(follower, authors):
+    from .models import Post, TimelineEntry
+
+    added = False
+    for each_author in authors:
+        if each_author.fan_out_on_read:
+            continue
+        added = True
+
+        newest_posts = select(
+            literal(follower.id),
+            Post.id,
+            Post.author_id,
+            Post.timestamp
+        ).where(Post.author_id == each_author.id) \
+            .order_by(*pagination.newest_first(pagination.cursor_keys(Post))) \
+            .limit(current_app.config['TIMELINE_MAX_ENTRIES'])
+
+        db.session.execute(
+            insert(TimelineEntry).prefix_with('OR IGNORE').from_select(
+                ['owner_id', 'post_id', 'author_id', 'timestamp'], newest_posts)
+        )
+    if added:
+        _trim([follower.id])
+
+
+# follower unfollowed author
+def remove_author(follower, author):
+    remove_authors(follower, [author])
+
+
+def remove_authors(follower, authors):
+    from .models import TimelineEntry
+    db.session.execute(delete(TimelineEntry).where(
+        TimelineEntry.owner_id == follower.id,
+        TimelineEntry.author_id.in_([each_author.id for each_author in authors])
+    ).execution_options(**NO_SYNC))
+
+
+# user is getting deleted, removing their timeline and their posts from other timelines
+def remove_user(user):
+    from .models import TimelineEntry
+    db.session.execute(delete(TimelineEntry).where(
+        (TimelineEntry.owner_id == user.id) | (TimelineEntry.author_id == user.id)
+    ).execution_options(**NO_SYNC))
+
+
+# a page of the followed users posts of user (newest first), returns (posts, next_cursor)
+def read_page(user, cursor, limit):
+    from .models import Follow, Post, TimelineEntry, User
+
+    pushed_posts = Post.query.join(TimelineEntry, TimelineEntry.post_id == Post.id) \
+        .filter(TimelineEntry.owner_id == user.id)
+    rows = pagination.fetch_page(pushed_posts, _timeline_keys(), cursor, limit)
+
+    # posts of followed users which are read on demand (fan_out_on_read)
+    pulled_posts = Post.query.join(Follow, Follow.following_to == Post.author_id) \
+        .join(User, User.id == Post.author_id) \
+        .filter(Follow.follower_id == user.id, User.fan_out_on_read.is_(True))
+    pulled_rows = pagination.fetch_page(pulled_posts, pagination.cursor_keys(Post), cursor, limit)
+
+    if pulled_rows:
+        # merging both lists (a post can be in both, if it was written before its author
+        # got switched to fan_out_on_read)
+        merged = {each_post.id: each_post for each_post in rows + pulled_rows}
+        rows = sorted(merged.values(), key=lambda x: (x.timestamp, x.id), reverse=True)[:limit + 1]
+
+    return pagination.split_page(rows, limit)
+
+
+# (re)building every timeline from the follows and posts tables, for existing data or
+# in case the timelines ever get out of sync
+def rebuild_all():
+    from .models import Follow, Post, TimelineEntry, User
+
+    db.session.execute(delete(TimelineEntry).execution_options(**NO_SYNC))
+
+    followed_posts = select(
+        Follow.follower_id,
+        Post.id,
+        Post.author_id,
+        Post.timestamp
+    ).join(Post, Post.author_id == Follow.following_to) \
+        .join(User, User.id == Post.author_id) \
+        .where(User.fan_out_on_read.is_(False))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(
+            ['owner_id', 'post_id', 'author_id', 'timestamp'], followed_posts)
+    )
+    _trim(select(User.id))
+    db.session.commit()
@@ -2,25 +2,45 @@ from datetime import datetime
 from datetime import timezone
 from datetime import timedelta
 from app.postRoute.errors import bad_request, custom404, forbidden
-from ..decorators import admin_required, permission_required, verify_user_token
+from ..decorators import admin_required, permission_required, read_only, verify_user_token
 from . import userRoute
 from flask_jwt_extended import jwt_required, get_jwt, current_user
 from ..models import Permission, Post, TokenBlocklist, User
-from flask import jsonify, request
+from flask import current_app, jsonify, request
+from .. import autocomplete
+from .. import blocklist
+from .. import conditional
+from .. import counters
 from .. import db
+from .. import follow_graph
+from .. import inbox
+from .. import loaders
+from .. import search
+from .. import streaming
+from .. import suggestions
+from .. import timeline
+from .. import versions
+from ..pagination import decode_rank_cursor, page_args
 from functools import wraps
 
 # get user
 @userRoute.route('/users/<int:id>')
+@read_only
 @jwt_required()
 # will match logged user id with the user id we are trying to fetch (needs to be equal)
 @verify_user_token
 def get_user(id):
-    user = User.query.get(id)
+    posts_cursor, posts_limit = page_args()
 
-    if not user:
+    # (304 without loading the profile when the client has the current version)
+    marker = versions.profile_marker(id, posts_cursor, posts_limit)
+    if marker is None:
         return custom404("User not found")
-    return jsonify(user.to_json())
+    if conditional.is_fresh(*marker):
+        return conditional.not_modified(*marker)
+
+    user = User.query.get(id)
+    return conditional.with_validators(jsonify(user.to_json(posts_cursor, posts_limit)), *marker)
 
 
 # update user name
@@ -42,7 +62,10 @@ def update_username():
     # user_to_update = User.query.get(get_user_id)
     # user_to_update.username = new_name
 
+    search.rename_user(current_user, new_name)
     current_user.username = new_name
+    autocomplete.user_renamed(current_user)
+    versions.user_changed(current_user)
     db.session.add(current_user)
     db.session.commit()
 
@@ -62,6 +85,7 @@ def update_email():
         return bad_request("email already in use.")
 
     current_user.email = new_email
+    versions.user_changed(current_user)
     db.session.add(current_user)
     db.session.commit()
 
@@ -78,6 +102,7 @@ def update_user_image():
         return bad_request("image field cannot be empty.")
 
     current_user.user_image_url = new_image_url
+    versions.user_changed(current_user)
     db.session.add(current_user)
     db.session.commit()
 
@@ -109,14 +134,20 @@ def update_user_password():
 
 # get logged user profile
 @userRoute.route('/user_profile/<int:id>')
+@read_only
 @jwt_required()
 def get_user_profile(id):    
 
-    user = User.query.get(id)
+    posts_cursor, posts_limit = page_args()
 
-    if not user:
+    marker = versions.profile_marker(id, posts_cursor, posts_limit)
+    if marker is None:
         return custom404("User not found")
-    return jsonify(user.to_json())
+    if conditional.is_fresh(*marker):
+        return conditional.not_modified(*marker)
+
+    user = User.query.get(id)
+    return conditional.with_validators(jsonify(user.to_json(posts_cursor, posts_limit)), *marker)
 
 
 
@@ -153,11 +184,17 @@ def delete_user(id):
             # blocking the token of the user which is going to be removed
             # getting jti obj of currently logged in user token
             jti = get_jwt()['jti']
-            now = datetime.now(timezone.utc)
-            db.session.add(TokenBlocklist(jti=jti, created_at=now))
+            blocklist.revoke(jti)
             db.session.commit()
 
         # deleting user
+        timeline.remove_user(user)
+        counters.remove_user(user)
+        inbox.remove_user(user)
+        follow_graph.user_removed(user.id)
+        search.remove_user(user)
+        autocomplete.user_removed(user)
+        versions.user_removed(user)
         db.session.delete(user)
         db.session.commit()
 
@@ -167,18 +204,73 @@ def delete_user(id):
 
 # get all users
 @userRoute.route('/users')
+@read_only
 @jwt_required()
 @admin_required
 def get_users_as_admin():
-    users = User.query.all()
-    return jsonify({"users": [each_user.to_json() for each_user in users]}), 200
+    # (every user comes with the first page of their posts, streamed, see app/streaming.py)
+    posts_limit = current_app.config['POSTS_PER_PAGE']
+    return streaming.stream_list(
+        "users", User.query, lambda each_user: each_user.to_json(),
+        prime=lambda users: loaders.prime_profiles(users, posts_limit))
 
 
 @userRoute.route('/all_users')
+@read_only
 @jwt_required()
 def get_all_users():
-    users = User.query.all()
-    return jsonify({"users": [each_user.less_user_info_json() for each_user in users]}), 200
+    # (streamed, see app/streaming.py)
+    return streaming.stream_list("users", User.query, lambda each_user: each_user.less_user_info_json())
+
+
+# full-text search of usernames (best match first), /search/users?q=...
+@userRoute.route('/search/users')
+@read_only
+@jwt_required()
+def search_users():
+    cursor, limit = page_args('SEARCH_USERS_PER_PAGE', decode=decode_rank_cursor)
+    found_users, next_cursor = search.users(request.args.get('q'), cursor, limit)
+    loaders.users().add(found_users)
+    return jsonify({
+        "users": [each_user.less_user_info_json() for each_user in found_users],
+        "next_cursor": next_cursor
+    })
+
+
+# usernames starting with ?q= (mention pickers, follow dialogs), users you follow come first
+@userRoute.route('/autocomplete/users')
+@read_only
+@jwt_required()
+def autocomplete_users():
+    _, limit = page_args('AUTOCOMPLETE_PER_PAGE')
+
+    users_data = []
+    for each_user, followed in autocomplete.complete(current_user, request.args.get('q'), limit):
+        users_data.append({
+            'user_id': each_user.id,
+            'username': each_user.username,
+            'profile_image': each_user.user_image_url,
+            'following': followed
+        })
+
+    return jsonify({"users": users_data}), 200
+
+
+# users the current user may want to follow (best first)
+@userRoute.route('/suggested_users')
+@read_only
+@jwt_required()
+def suggested_users():
+    _, limit = page_args('SUGGESTIONS_PER_PAGE')
+
+    users_data = []
+    for each_user, shared_connections, shared_engagement in suggestions.suggest(current_user, limit):
+        user_data = each_user.less_user_info_json()
+        user_data['shared_connections'] = shared_connections
+        user_data['shared_engagement'] = shared_engagement
+        users_data.append(user_data)
+
+    return jsonify({"users": users_data}), 200
 
 
 # follow a user
@@ -220,8 +312,75 @@ def unfollow_user(username):
             db.session.commit()
             return jsonify({"msg": f"Unfollowed {username}."})
 
+
+# list of user ids from the request body (bulk endpoints), None if it is not a valid list
+def user_ids_arg():
+    user_ids = (request.json or {}).get('user_ids', None)
+    if not isinstance(user_ids, list) or not user_ids:
+        return None
+    if len(user_ids) > current_app.config['MAX_BATCH_SIZE']:
+        return None
+    if not all(isinstance(each_id, int) and not isinstance(each_id, bool) for each_id in user_ids):
+        return None
+    return user_ids
+
+
+# follow status of the current user with many users at once (for lists of users with follow buttons)
+@userRoute.route('/relationships', methods=['POST'])
+@jwt_required()
+def relationships():
+    user_ids = user_ids_arg()
+    if user_ids is None:
+        return bad_request("user_ids must be a list of at most %d user ids." % current_app.config['MAX_BATCH_SIZE'])
+
+    status = current_user.relationship_status(user_ids)
+    return jsonify({"relationships": [
+        dict(user_id=each_id, **each_status) for each_id, each_status in status.items()
+    ]})
+
+
+# following many users in a single transaction (onboarding)
+@userRoute.route('/follow', methods=['POST'])
+@jwt_required()
+@permission_required(Permission.FOLLOW)
+def follow_users():
+    user_ids = user_ids_arg()
+    if user_ids is None:
+        return bad_request("user_ids must be a list of at most %d user ids." % current_app.config['MAX_BATCH_SIZE'])
+    if current_user.id in user_ids:
+        return bad_request("you cannot follow yourself.")
+
+    users = User.query.filter(User.id.in_(user_ids)).all()
+    if len(users) != len(set(user_ids)):
+        return custom404("user not found.")
+
+    followed = current_user.follow_many(users)
+    db.session.commit()
+    return jsonify({"msg": f"Started Following {len(followed)} users.",
+                    "followed": sorted(each_user.id for each_user in followed)})
+
+
+# unfollowing many users in a single transaction
+@userRoute.route('/unfollow', methods=['POST'])
+@jwt_required()
+@permission_required(Permission.FOLLOW)
+def unfollow_users():
+    user_ids = user_ids_arg()
+    if user_ids is None:
+        return bad_request("user_ids must be a list of at most %d user ids." % current_app.config['MAX_BATCH_SIZE'])
+
+    users = User.query.filter(User.id.in_(user_ids)).all()
+    if len(users) != len(set(user_ids)):
+        return custom404("user not found.")
+
+    unfollowed = current_user.unfollow_many(users)
+    db.session.commit()
+    return jsonify({"msg": f"Unfollowed {len(unfollowed)} users.",
+                    "unfollowed": sorted(each_user.id for each_user in unfollowed)})
+
 # user followers
 @userRoute.route('/followers/<username>')
+@read_only
 @jwt_required()
 def see_followers(username):
     user = User.query.filter_by(username=username).first()
@@ -231,9 +390,8 @@ def see_followers(username):
 
     followers_data = []
     if user.username == current_user.username:
-        my_followers = user.got_followed_back_list.all()
-        for each_follower in my_followers:
-            locate_user = User.query.get(each_follower.follower_id)
+        # (ids from the in-memory follow graph, app/follow_graph.py)
+        for locate_user in loaders.prime_users(follow_graph.followers_of(user.id)):
             followers_data.append(locate_user.username)
         return jsonify({"followers": followers_data})
     else:
@@ -242,6 +400,7 @@ def see_followers(username):
 
 # following to (returns current user following to list)
 @userRoute.route('/following/<username>')
+@read_only
 @jwt_required()
 def see_following_to(username):
     user = User.query.filter_by(username=username).first()
@@ -251,10 +410,27 @@ def see_following_to(username):
 
     following_to_data = []
     if user.username == current_user.username:
-        user_followed = user.following_to_list.all()
-        for each_user in user_followed:
-            locate_user = User.query.get(each_user.following_to)
+        for locate_user in loaders.prime_users(follow_graph.following_of(user.id)):
             following_to_data.append(locate_user.username)
         return jsonify({"following": following_to_data})
+    else:
+        return forbidden("not allowed.")
+
+
+# users who follow the user and are followed back by them
+@userRoute.route('/mutuals/<username>')
+@read_only
+@jwt_required()
+def see_mutuals(username):
+    user = User.query.filter_by(username=username).first()
+
+    if not user:
+        return custom404("user not found")
+
+    mutuals_data = []
+    if user.username == current_user.username:
+        for locate_user in loaders.prime_users(follow_graph.mutuals_of(user.id)):
+            mutuals_data.append(locate_user.username)
+        return jsonify({"mutuals": mutuals_data})
     else:
         return forbidden("not allowed.")
\ No newline at end of file
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from . import db
+
+# cache of the logged in user (current_user) for user_lookup_callback
+# every @jwt_required() request used to load the user and then lazily its role, just to find out
+# who is asking and what they are allowed to do. now the identity columns (role_id included, the
+# role itself comes from app/role_registry.py) of recently seen users are kept in memory (per worker process, least recently used ones get dropped after
+# USER_CACHE_SIZE users, entries expire after USER_CACHE_TTL seconds).
+#
+# only plain column values are cached, never the objects themselves (an object belongs to the
+# session of the request which loaded it). for a cache hit a User is rebuilt
+# from those values and attached to the session of the current request without running a
+# query, so current_user still works as usual for updates, follows etc. columns which are not
+# cached (password hash, counters ...) are loaded from the database the first time they are used.
+#
+# a user is dropped from the cache as soon as a change to one of the cached columns (or their
+# deletion) gets committed. other gunicorn
+# workers do not see that commit, they keep their copy until it expires (so at most
+# USER_CACHE_TTL seconds).
+
+USER_COLUMNS = ['id', 'role_id', 'email', 'username', 'user_image_url']
+
+
+class LRUCache:
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl, max_size):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+users = LRUCache()
+
+
+def _snapshot(obj, columns):
+    return {each_column: getattr(obj, each_column) for each_column in columns}
+
+
+# the object with this primary key in the session of the current request, built from cached
+# values if the session does not have it yet
+def _attach(model, values):
+    key = identity_key(model, values['id'])
+    obj = db.session.identity_map.get(key)
+    if obj is not None:
+        return obj
+
+    obj = model.__mapper__.class_manager.new_instance()
+    for each_column, each_value in values.items():
+        set_committed_value(obj, each_column, each_value)
+    make_transient_to_detached(obj)
+    db.session.add(obj)
+    return obj
+
+
+def load_user(user_id):
+    from .models import User
+
+    cached = users.get(user_id)
+    if cached is not None:
+        return _attach(User, cached)
+
+    user = User.query.filter_by(id=user_id).one_or_none()
+    # missing (deleted) users are not cached, so a new user can never see a stale "not found"
+    if user is None:
+        return None
+
+    users.put(
+        user_id,
+        _snapshot(user, USER_COLUMNS),
+        current_app.config['USER_CACHE_TTL'],
+        current_app.config['USER_CACHE_SIZE']
+    )
+    return user
+
+
+# finding changed users at flush time (that is when the session still knows what changed),
+# and dropping them from the cache once the transaction is committed
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    from .models import User
+
+    changed = session.info.setdefault('user_cache_changes', set())
+
+    for each_obj in session.deleted:
+        if isinstance(each_obj, User):
+            changed.add(each_obj.id)
+
+    for each_obj in session.dirty:
+        if isinstance(each_obj, User) and session.is_modified(each_obj):
+            state = inspect(each_obj)
+            if any(state.attrs[each_column].history.has_changes() for each_column in USER_COLUMNS):
+                changed.add(each_obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate(session):
+    changed = session.info.pop('user_cache_changes', set())
+    for each_id in changed:
+        users.discard(each_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('user_cache_changes', None)
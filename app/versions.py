@@ -0,0 +1,106 @@
+import hashlib
+from datetime import datetime
+from sqlalchemy import select, union, update
+from . import db
+from . import like_buffer
+from . import pagination
+
+# content versions of posts and users (for ETag / Last-Modified, see app/conditional.py)
+# Post.version and User.version grow by one whenever something in their json changes, and
+# updated_at is set to that time. checking whether a client still has the current post or profile
+# is then a query on a few columns, without loading likes, comments etc. or running to_json.
+#
+# what bumps them:
+# - every counter change (like, comment, follow, new/deleted post), done by app/counters.py
+# - edit_post, and changes to the username/email/image of a user. a user shows up in their posts
+#   (author), in the posts they liked or commented on and in the follower lists of the users they
+#   follow/are followed by, so those are bumped as well (user_changed)
+NO_SYNC = {'synchronize_session': False}
+
+
+# values for an update statement bumping the version (for the bulk updates of app/counters.py)
+def bumped(model):
+    return {'version': model.version + 1, 'updated_at': datetime.utcnow()}
+
+
+def touch(obj):
+    # (__class__ and not type(), current_user is a proxy of the user)
+    for each_column, each_value in bumped(obj.__class__).items():
+        setattr(obj, each_column, each_value)
+    db.session.add(obj)
+
+
+# ids can be a list or a select of ids
+def touch_many(model, ids):
+    db.session.execute(
+        update(model).where(model.id.in_(ids)).values(bumped(model)).execution_options(**NO_SYNC))
+
+
+# every post and profile showing user (apart from their own posts, the etag of a post
+# includes the version of its author)
+def _shown_in(user):
+    from .models import Comment, Follow, Post, PostLike, User
+
+    touch_many(Post, union(
+        select(PostLike.post_id).where(PostLike.user_id == user.id),
+        select(Comment.post_id).where(Comment.author_id == user.id)
+    ))
+    touch_many(User, union(
+        select(Follow.follower_id).where(Follow.following_to == user.id),
+        select(Follow.following_to).where(Follow.follower_id == user.id)
+    ))
+
+
+def user_changed(user):
+    touch(user)
+    _shown_in(user)
+
+
+def user_removed(user):
+    _shown_in(user)
+
+
+def _etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+def _latest(*times):
+    times = [each_time for each_time in times if each_time is not None]
+    return max(times) if times else None
+
+
+# (etag, last modified) of the json of post id, None if there is no such post
+def post_marker(id):
+    from .models import Post, User
+
+    row = db.session.query(
+        Post.version, Post.updated_at, Post.timestamp, User.version, User.updated_at
+    ).outerjoin(User, User.id == Post.author_id).filter(Post.id == id).first()
+    if row is None:
+        return None
+
+    post_version, post_updated_at, post_timestamp, author_version, author_updated_at = row
+    # (likes of the logged in user which are not written yet change the post for them)
+    return (_etag('post', id, post_version, author_version, like_buffer.own_marker([id])),
+            _latest(post_updated_at or post_timestamp, author_updated_at))
+
+
+# (etag, last modified) of User.to_json(posts_cursor, posts_limit) of user id, None if there is
+# no such user. the posts page is part of it, so the versions of its posts are read as well
+# (same range scan as the page itself, only a few columns)
+def profile_marker(id, posts_cursor, posts_limit):
+    from .models import Post, User
+
+    user_row = db.session.query(User.version, User.updated_at).filter(User.id == id).first()
+    if user_row is None:
+        return None
+
+    page_rows = pagination.fetch_page(
+        db.session.query(Post.id, Post.timestamp, Post.version, Post.updated_at).filter(Post.author_id == id),
+        pagination.cursor_keys(Post), posts_cursor, posts_limit)
+
+    etag = _etag('user', id, user_row.version, posts_cursor, posts_limit,
+                 [(each_row.id, each_row.version) for each_row in page_rows],
+                 like_buffer.own_marker([each_row.id for each_row in page_rows]))
+    last_modified = _latest(user_row.updated_at, *[each_row.updated_at or each_row.timestamp for each_row in page_rows])
+    return etag, last_modified
@@ -1,13 +1,88 @@
 import os
+from datetime import timedelta
 basedir = os.path.abspath(os.path.dirname(__file__))
 from flask_jwt_extended import JWTManager
+from sqlalchemy.pool import QueuePool
 
 
 class Config:
 
     SECRET_KEY = "some_unique_key"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # sqlite pragmas of every connection and pool of the @read_only endpoints, 0 for none (app/database.py)
+    SQLITE_PRAGMAS = {}
+    SQLITE_READ_POOL_SIZE = 0
     APP_ADMIN = "xyz@gmail.com" # place your email here
+    # lifetime of the tokens created in login
+    # more time options => https://docs.python.org/3/library/datetime.html#timedelta-objects
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=40)
+    # revoked tokens (app/blocklist.py)
+    BLOCKLIST_REFRESH_SECONDS = 5
+    POSTS_PER_PAGE = 20
+    MESSAGES_PER_PAGE = 50
+    CONVERSATIONS_PER_PAGE = 20
+    MAX_PAGE_SIZE = 100
+    # most user ids one bulk request (relationship status, batch follow) can take
+    MAX_BATCH_SIZE = 500
+    # sql queries per request, in response headers and the log, statements repeated more than
+    # QUERY_STATS_REPEAT_THRESHOLD times in a request are logged as N+1 (app/query_stats.py)
+    QUERY_STATS_ENABLED = False
+    QUERY_STATS_HEADERS = False
+    QUERY_STATS_REPEAT_THRESHOLD = 10
+    # request metrics on GET /metrics (admins only), every worker writes its counters to
+    # METRICS_DIR every METRICS_WRITE_SECONDS (app/metrics.py). on in production, they time every
+    # sql statement too (the engine events of app/query_stats.py, not its headers and log).
+    # one METRICS_DIR per deployment, it is emptied when gunicorn starts (gunicorn.conf.py)
+    METRICS_ENABLED = False
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(basedir, 'metrics')
+    METRICS_WRITE_SECONDS = 5
+    # requests profiled when an admin sends PROFILING_HEADER or one in PROFILING_SAMPLE_RATE
+    # (0 for none), the newest PROFILING_MAX_FILES profiles are kept in PROFILING_DIR (app/profiling.py)
+    PROFILING_ENABLED = False
+    PROFILING_HEADER = 'X-Profile'
+    PROFILING_SAMPLE_RATE = 0
+    PROFILING_DIR = os.environ.get('PROFILING_DIR') or os.path.join(basedir, 'profiles')
+    PROFILING_MAX_FILES = 50
+    # orjson for the json of responses, when it is installed (app/json_provider.py)
+    JSON_FAST_ENCODER = True
+    # rows read (and written out) at a time by streamed lists (app/streaming.py)
+    STREAM_CHUNK_SIZE = 200
+    # logged in users cache (app/user_cache.py)
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60
+    # password hashing (app/passwords.py), changing method or iterations rehashes on next login
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256'
+    PASSWORD_HASH_ITERATIONS = 260000
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_PROCESSES = 2
+    PASSWORD_HASH_MAX_PENDING = 8
+    # roles registry (app/role_registry.py)
+    ROLE_REGISTRY_TTL = 300
+    # in-memory follow graph (app/follow_graph.py)
+    FOLLOW_GRAPH_REFRESH_SECONDS = 1
+    SEARCH_USERS_PER_PAGE = 20
+    # username autocomplete (app/autocomplete.py)
+    AUTOCOMPLETE_PER_PAGE = 10
+    AUTOCOMPLETE_REFRESH_SECONDS = 1
+    AUTOCOMPLETE_REBUILD_SECONDS = 300
+    # suggested users (app/suggestions.py)
+    SUGGESTIONS_PER_PAGE = 20
+    SUGGESTIONS_TTL = 600
+    SUGGESTIONS_CACHE_SIZE = 10000
+    SUGGESTIONS_MAX_FOLLOWED = 200
+    SUGGESTIONS_MAX_NEIGHBOURS = 500
+    SUGGESTIONS_RECENT_LIKES = 100
+    # write-behind likes, written in batches every LIKE_BUFFER_FLUSH_MS or LIKE_BUFFER_MAX_EVENTS
+    # (app/like_buffer.py)
+    LIKE_BUFFER_ENABLED = False
+    LIKE_BUFFER_FLUSH_MS = 200
+    LIKE_BUFFER_MAX_EVENTS = 1000
+    # (how long the time of the last like / unlike of a user on a post is kept)
+    LIKE_BUFFER_KEEP_ACTIONS_SECONDS = 3600
+    # home timeline (app/timeline.py)
+    TIMELINE_MAX_ENTRIES = 500
+    TIMELINE_FANOUT_LIMIT = 5000
+    TIMELINE_TRIM_EVERY = 20
 
     @staticmethod
     def init_app(app):
@@ -16,16 +91,37 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    QUERY_STATS_ENABLED = True
+    QUERY_STATS_HEADERS = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
 
 
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    # (cheap hashes, in the request thread)
+    PASSWORD_HASH_ITERATIONS = 1000
+    PASSWORD_HASH_PROCESSES = 0
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+    # (kept open connections, instead of a new one for every request, the pragmas are per connection)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'poolclass': QueuePool,
+        'pool_size': 4,
+        'connect_args': {'check_same_thread': False}
+    }
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'busy_timeout': 5000,  # ms
+        'mmap_size': 256 * 1024 * 1024,  # bytes
+        'cache_size': -64 * 1024,  # negative: KiB (64 MB)
+        'temp_store': 'memory'
+    }
+    SQLITE_READ_POOL_SIZE = 8
+    METRICS_ENABLED = True
 
 
 config = {
@@ -0,0 +1,16 @@
+# gunicorn settings, read by `gunicorn main:app` run from this folder
+from config import config
+
+
+# the request metrics of an earlier run of the server (app/metrics.py)
+# (METRICS_DIR of the config main.py creates the app with)
+def on_starting(server):
+    from app import metrics
+    metrics.clear(config['default'].METRICS_DIR)
+
+
+# likes still waiting in the buffer of the worker (app/like_buffer.py), also written by atexit,
+# this one runs for a worker gunicorn stops too
+def worker_exit(server, worker):
+    from app import like_buffer
+    like_buffer.flush()
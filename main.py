@@ -1,7 +1,8 @@
+import click
 from dotenv import load_dotenv
 from app import create_app, db
 from flask_migrate import Migrate
-from app.models import Follow, PostLike, Role, TokenBlocklist, User, Post, Comment, Message
+from app.models import Conversation, Follow, FollowEvent, PostLike, Role, TimelineEntry, TokenBlocklist, User, Post, Comment, Message
 # from flask import request
 
 load_dotenv()
@@ -20,12 +21,105 @@ def make_shell_context():
         TokenBlocklist=TokenBlocklist,
         Role=Role,
         Follow=Follow,
+        FollowEvent=FollowEvent,
         Comment=Comment,
         Message=Message,
-        PostLike=PostLike
+        PostLike=PostLike,
+        TimelineEntry=TimelineEntry,
+        Conversation=Conversation
     )
 
 
+# fills the home timelines from the existing follows and posts (needed once for an existing
+# database, afterwards they are kept up to date by the app)
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    from app import timeline
+    timeline.rebuild_all()
+    print("Timelines rebuilt.")
+
+
+# recounts likes, comments, followers, followed users and posts of every post/user
+@app.cli.command('rebuild-counters')
+def rebuild_counters():
+    from app import counters
+    counters.rebuild_all()
+    print("Counters rebuilt.")
+
+
+# fills the inbox summaries from the existing messages
+@app.cli.command('rebuild-inbox')
+def rebuild_inbox():
+    from app import inbox
+    inbox.rebuild_all()
+    print("Inbox rebuilt.")
+
+
+# deletes revoked tokens which are expired anyway (meant to be run regularly, example from cron)
+@app.cli.command('purge-blocklist')
+def purge_blocklist():
+    from app import blocklist
+    deleted = blocklist.purge()
+    print(f"Deleted {deleted} expired tokens.")
+
+
+# fills the full-text search indexes from the existing posts, users and messages
+@app.cli.command('rebuild-search')
+def rebuild_search():
+    from app import search
+    search.rebuild_all()
+    print("Search indexes rebuilt.")
+
+
+# compares the response json encoders on Post.to_json of the newest posts
+@app.cli.command('benchmark-json')
+def benchmark_json():
+    from app import loaders
+    from app.json_provider import benchmark
+
+    with app.test_request_context():
+        posts = loaders.prime_posts(Post.query.order_by(Post.timestamp.desc()).limit(100).all())
+        payloads = {"posts": [each_post.to_json() for each_post in posts]}
+
+    if not payloads["posts"]:
+        print("No posts to encode, create some first.")
+        return
+
+    print(f"Encoding {len(payloads['posts'])} posts:")
+    for each_name, each_seconds in benchmark(app, payloads).items():
+        print(f"  {each_name:15} {each_seconds * 1000:.3f} ms")
+
+
+# likes per second with and without the like buffer (app/like_buffer.py), on a temporary database
+@app.cli.command('benchmark-likes')
+@click.option('--events', default=5000)
+@click.option('--threads', default=8)
+def benchmark_likes(events, threads):
+    from app.like_buffer import benchmark
+    print(f"{events} like / unlike events from {threads} threads:")
+    for each_name, each_rate in benchmark(app, events, threads).items():
+        print(f"  {each_name:22} {each_rate:8.0f} likes/s")
+
+
+# sqlite query plans of the hot queries (app/query_plans.py)
+@app.cli.command('query-plans')
+def query_plans():
+    from app.query_plans import explain
+    with db.engine.connect() as connection:
+        for each_name, each_plan in explain(connection):
+            print(each_name)
+            for each_line in each_plan:
+                print('    ' + each_line)
+
+
+# deletes follow graph events older than a day (every worker has applied them by then)
+@app.cli.command('purge-follow-events')
+def purge_follow_events():
+    from app import follow_graph
+    deleted = follow_graph.purge()
+    print(f"Deleted {deleted} follow events.")
+
+
 @app.cli.command()
 def test():
     import unittest